@@ -0,0 +1,57 @@
+# Batch import and export of reservations, e.g. for group bookings or feeds from a channel manager.
+# Importing reads bookings from a CSV file (with a header row naming the columns customer_name, num_people, check_in,
+# check_out, room_type and optionally room_id) or a JSON lines file (one booking object per line, using the same
+# names), makes them all with HotelManager.make_reservations and lists the bookings that failed.
+# Exporting writes the reservations overlapping the given dates to standard output as CSV or JSON lines.
+# Usage:
+#   python batch_bookings.py import <bookings.csv|bookings.jsonl>
+#   python batch_bookings.py export {csv|json} [from DD/MM/YYYY] [to DD/MM/YYYY]
+import csv
+import json
+import sys
+
+from common_functionalities import HotelManager, RoomManager, ReservationManager, Validator
+
+
+# Reads the bookings in a CSV or JSON lines file one at a time, so the file never has to fit in memory
+def read_bookings(file_name):
+    with open(file_name, 'r', newline='') as file:
+        if file_name.endswith(('.jsonl', '.json')):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def import_bookings(hotel_manager, file_name):
+    made, failed = hotel_manager.make_reservations(read_bookings(file_name))
+    print(f"Made {len(made)} reservations, {len(failed)} bookings failed.")
+    for row_number, error in failed:
+        print(f"Row {row_number}: {error}")
+    return not failed
+
+
+def export_reservations(hotel_manager, file_format='csv', start_date=None, end_date=None):
+    sys.stdout.writelines(hotel_manager.reservation_manager.export_reservations(start_date, end_date, file_format))
+    return True
+
+
+COMMANDS = {
+    'import': import_bookings,
+    'export': export_reservations,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in COMMANDS:
+        print("Usage: python batch_bookings.py import <bookings.csv|bookings.jsonl>\n"
+              "       python batch_bookings.py export {csv|json} [from DD/MM/YYYY] [to DD/MM/YYYY]")
+        sys.exit(1)
+    validator = Validator()
+    manager = HotelManager(RoomManager("hotel_room.csv", validator), ReservationManager("reservations.csv"),
+                           validator)
+    try:
+        sys.exit(0 if COMMANDS[sys.argv[1]](manager, *sys.argv[2:]) else 1)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,477 @@
+# Benchmarks for the hotel booking system. Each benchmark prints how long an operation takes so changes to the shared
+# code in common_functionalities can be compared before and after.
+# The suite benchmark runs the main operations of the booking core over synthetic hotels of every size from 1,000 up
+# to the given number of reservations and from 10 up to the given number of rooms, and appends the timings and peak
+# memory of the run to benchmark_results.json, so runs of different versions can be compared side by side.
+# The shared benchmark starts a shared occupancy writer over a synthetic hotel and compares worker processes that
+# search their own availability index with worker processes that search the shared index, for 1 up to the given
+# number of workers. It checks every worker's answers against the index of the benchmark process, then kills the
+# writer and checks that the workers go back to searching their own index and still give the same answers.
+# Usage: python benchmarks.py {references|dates|startup} [count]
+#        python benchmarks.py suite [max reservations] [max rooms]
+#        python benchmarks.py shared [max workers] [reservations] [rooms] [seconds]
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from common_functionalities import (CsvReservationStorage, HotelManager, RoomManager, ReservationManager, Validator,
+                                    np, parse_date)
+from shared_occupancy import SharedOccupancyReader, remove_shared_index
+
+SUITE_RESULTS_FILE = "benchmark_results.json"
+SUITE_ROOM_TYPES = (('Standard-Single', 1, 30), ('Standard-Double', 2, 35), ('Deluxe-Double', 2, 50),
+                    ('Family', 4, 60), ('Suit', 4, 75))
+SUITE_HISTORY_DAYS = 3650  # Synthetic stays are spread over the ten years before today and the year after
+SUITE_CALLS = 200  # Number of searches, bookings and cancellations timed for every dataset
+SUITE_LOOKUPS = 10_000  # Number of reference lookups timed for every dataset
+SUITE_TRACED_CALLS = 20  # Number of calls of each operation repeated under tracemalloc to find its peak memory
+SHARED_CHECKS = 50  # Number of searches every worker of the shared benchmark answers for checking
+SHARED_WRITES_PER_SECOND = 20  # Bookings the shared benchmark makes while the workers search
+SHARED_WRITER_CATCH_UP_SECONDS = 1.0  # Time given to the writer to pick up the last bookings before checking
+SHARED_OCCUPANCY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_occupancy.py")
+
+
+# Creates a HotelManager over the hotel's data files, the same way the text console does
+def create_hotel_manager():
+    return HotelManager(RoomManager("hotel_room.csv", Validator()), ReservationManager("reservations.csv"),
+                        Validator())
+
+
+# Measures how many reference numbers per second can be minted, both one at a time (as make_reservation does) and
+# in bulk (as a batch import would), and checks that the bulk references are unique
+def benchmark_references(count=1_000_000):
+    hotel_manager = create_hotel_manager()
+
+    single_count = min(count, 100_000)
+    start = time.perf_counter()
+    for _ in range(single_count):
+        hotel_manager.generate_reference()
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    references = hotel_manager.generate_references(count)
+    bulk_seconds = time.perf_counter() - start
+
+    if len(set(references)) != count:
+        raise AssertionError("generate_references returned duplicate reference numbers.")
+    print(f"generate_reference:  {single_count:>10,} references in {single_seconds:.3f}s "
+          f"({single_count / single_seconds:,.0f}/s)")
+    print(f"generate_references: {count:>10,} references in {bulk_seconds:.3f}s ({count / bulk_seconds:,.0f}/s)")
+
+
+# Compares datetime.strptime with parse_date for the DD/MM/YYYY strings the program works with. The uncached run
+# calls the parser behind the cache directly, so it shows the hand-rolled parser on its own.
+def benchmark_dates(count=1_000_000):
+    first_day = date(2024, 1, 1)
+    date_strings = [(first_day + timedelta(days=i % 730)).strftime('%d/%m/%Y') for i in range(count)]
+
+    timings = {}
+    start = time.perf_counter()
+    for date_str in date_strings:
+        datetime.strptime(date_str, '%d/%m/%Y').date()
+    timings['datetime.strptime'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for date_str in date_strings:
+        parse_date.__wrapped__(date_str)
+    timings['parse_date (uncached)'] = time.perf_counter() - start
+
+    parse_date.cache_clear()
+    start = time.perf_counter()
+    for date_str in date_strings:
+        parse_date(date_str)
+    timings['parse_date (cached)'] = time.perf_counter() - start
+
+    for name, seconds in timings.items():
+        print(f"{name:<22} {count:>10,} dates in {seconds:.3f}s ({count / seconds:,.0f}/s, "
+              f"{timings['datetime.strptime'] / seconds:.1f}x strptime)")
+
+
+# Compares loading a large reservations file from scratch with loading it from its snapshot, both straight after the
+# snapshot was written and after more bookings have been appended to the file since
+def benchmark_startup(count=200_000):
+    directory = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(directory, "reservations.csv")
+        first_day = date(2024, 1, 1)
+        with open(file_name, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(CsvReservationStorage.HEADER)
+            for i in range(count):
+                check_in = first_day + timedelta(days=i % 1000)
+                writer.writerow([f"R{i:07d}", f"Guest {i}", 'Family', check_in.strftime('%d/%m/%Y'),
+                                 (check_in + timedelta(days=2)).strftime('%d/%m/%Y'), 120.0, 10 + i % 2])
+
+        timings = {}
+        start = time.perf_counter()
+        ReservationManager(file_name)
+        timings['without snapshot'] = time.perf_counter() - start
+
+        parse_date.cache_clear()
+        start = time.perf_counter()
+        reservation_manager = ReservationManager(file_name)
+        timings['from snapshot'] = time.perf_counter() - start
+
+        journal_rows = CsvReservationStorage.SNAPSHOT_JOURNAL_ROWS - 1
+        reservation_manager.storage.append([reservation for _, reservation in
+                                            zip(range(journal_rows), reservation_manager.reservations.values())])
+        start = time.perf_counter()
+        ReservationManager(file_name)
+        timings[f"snapshot + {journal_rows} rows"] = time.perf_counter() - start
+
+        for name, seconds in timings.items():
+            print(f"{name:<24} {count:>10,} reservations in {seconds * 1000:.1f}ms")
+    finally:
+        shutil.rmtree(directory)
+
+
+# Writes a hotel_room.csv with the given number of rooms, cycling through the room types
+def write_synthetic_rooms(file_name, room_count):
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Room ID', 'Room Type', 'Max People', 'Price'])
+        for room_id in range(1, room_count + 1):
+            room_type, max_people, price = SUITE_ROOM_TYPES[room_id % len(SUITE_ROOM_TYPES)]
+            writer.writerow([room_id, room_type, max_people, price])
+
+
+# Writes a reservations.csv with the given number of stays of 1 to 7 nights in random rooms, mostly in the past ten
+# years and some in the coming year. Stays are placed at random, so the busiest datasets are overbooked, as a
+# hotel whose file was written by an older version without room allocation could be.
+def write_synthetic_reservations(file_name, room_count, reservation_count, seed=0):
+    randomiser = random.Random(seed)
+    first_day = date.today().toordinal() - SUITE_HISTORY_DAYS
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CsvReservationStorage.HEADER)
+        for i in range(reservation_count):
+            room_id = randomiser.randint(1, room_count)
+            room_type, _, price = SUITE_ROOM_TYPES[room_id % len(SUITE_ROOM_TYPES)]
+            nights = randomiser.randint(1, 7)
+            check_in = date.fromordinal(first_day + randomiser.randrange(SUITE_HISTORY_DAYS + 365))
+            writer.writerow([f"S{i:09d}", f"Guest {i}", room_type, check_in.strftime('%d/%m/%Y'),
+                             (check_in + timedelta(days=nights)).strftime('%d/%m/%Y'), float(price * nights),
+                             room_id])
+
+
+# Times calling operation with each of the argument tuples, then calls it again with the first few of them under
+# tracemalloc to find the peak memory it allocates. Errors raised by the operation (such as a fully booked hotel)
+# are counted rather than stopping the benchmark.
+def measure(operation, arguments, traced_arguments=None):
+    errors = 0
+    start = time.perf_counter()
+    for args in arguments:
+        try:
+            operation(*args)
+        except Exception:
+            errors += 1
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        for args in (arguments[:SUITE_TRACED_CALLS] if traced_arguments is None else traced_arguments):
+            try:
+                operation(*args)
+            except Exception:
+                pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'calls': len(arguments), 'errors': errors, 'seconds': round(seconds, 6),
+            'mean_us': round(seconds / max(len(arguments), 1) * 1_000_000, 2), 'peak_memory_bytes': peak}
+
+
+# Returns the given number of random stays in the coming year as (check in, check out, number of people) strings
+def random_stays(randomiser, count):
+    today = date.today().toordinal()
+    stays = []
+    for _ in range(count):
+        check_in = date.fromordinal(today + randomiser.randint(1, 365))
+        stays.append((check_in.strftime('%d/%m/%Y'),
+                      (check_in + timedelta(days=randomiser.randint(1, 7))).strftime('%d/%m/%Y'),
+                      randomiser.randint(1, 4)))
+    return stays
+
+
+# Runs every operation of the suite over a synthetic hotel and returns the measurements by operation
+def benchmark_dataset(directory, reservation_count, room_count):
+    room_file = os.path.join(directory, "hotel_room.csv")
+    reservation_file = os.path.join(directory, "reservations.csv")
+    write_synthetic_rooms(room_file, room_count)
+    write_synthetic_reservations(reservation_file, room_count, reservation_count)
+    if os.path.exists("rate_plans.csv"):
+        shutil.copy("rate_plans.csv", directory)
+
+    validator = Validator()
+    results = {}
+    hotel_manager = None
+
+    # Loads the hotel as the consoles do, either parsing every reservation or from the snapshot the previous load
+    # wrote
+    def load_hotel(from_snapshot):
+        nonlocal hotel_manager
+        if not from_snapshot and os.path.exists(reservation_file + '.snapshot'):
+            os.remove(reservation_file + '.snapshot')
+        parse_date.cache_clear()
+        hotel_manager = HotelManager(RoomManager(room_file, validator), ReservationManager(reservation_file),
+                                     validator)
+        hotel_manager.room_manager.get_availability_index(hotel_manager.reservation_manager)
+
+    results['read_room_data'] = measure(RoomManager(room_file, validator).read_room_data, [(room_file,)] * 20)
+    results['load (without snapshot)'] = measure(load_hotel, [(False,)])
+    results['load (from snapshot)'] = measure(load_hotel, [(True,)])
+
+    room_manager = hotel_manager.room_manager
+    reservation_manager = hotel_manager.reservation_manager
+    randomiser = random.Random(1)
+    stays = random_stays(randomiser, SUITE_CALLS)
+
+    # Clears the search cache before every search, so the searches themselves are timed
+    def search(check_in_date, check_out_date, num_people):
+        room_manager.search_cache.clear()
+        return room_manager.filter_room_options(check_in_date, check_out_date, num_people, reservation_manager)
+
+    results['filter_room_options'] = measure(search, stays)
+    results['filter_room_options (cached)'] = measure(room_manager.filter_room_options,
+                                                      [stays[0] + (reservation_manager,)] * SUITE_CALLS)
+
+    references = []
+
+    def book(check_in_date, check_out_date, num_people):
+        options = room_manager.filter_room_options(check_in_date, check_out_date, num_people, reservation_manager)
+        if not options:
+            raise ValueError("No rooms available.")
+        references.append(hotel_manager.make_reservation("Benchmark Guest", num_people, check_in_date,
+                                                         check_out_date, options[0])[0])
+
+    results['make_reservation'] = measure(book, stays)
+
+    existing = list(reservation_manager.reservations)
+    results['reference lookup'] = measure(reservation_manager.get, [(randomiser.choice(existing),)
+                                                                    for _ in range(SUITE_LOOKUPS)])
+    # Each booking can only be cancelled once, so the bookings made under tracemalloc are cancelled there
+    traced = min(SUITE_TRACED_CALLS, len(references))
+    results['cancel_reservation'] = measure(reservation_manager.cancel_reservation,
+                                            [(reference,) for reference in references[traced:]],
+                                            [(reference,) for reference in references[:traced]])
+    return results
+
+
+# Returns the commit the benchmarks were run on, if they were run in a git checkout
+def current_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs the operations of the booking core over synthetic hotels with 10^3 up to max_reservations reservations and 10
+# up to max_rooms rooms (in powers of ten) and appends the results of the run to benchmark_results.json. The
+# largest datasets take minutes to generate and gigabytes of memory to load, hence the defaults.
+def benchmark_suite(max_reservations=100_000, max_rooms=1_000):
+    run = {
+        'version': current_version(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np is not None,
+        'datasets': []
+    }
+    reservation_counts = [10 ** power for power in range(3, 8) if 10 ** power <= max_reservations]
+    room_counts = [10 ** power for power in range(1, 5) if 10 ** power <= max_rooms]
+    print(f"{'Reservations':>12} {'Rooms':>6}  {'Operation':<30}{'Calls':>7}{'Errors':>7}{'Mean':>12}"
+          f"{'Peak memory':>14}")
+    for reservation_count in reservation_counts:
+        for room_count in room_counts:
+            directory = tempfile.mkdtemp()
+            try:
+                results = benchmark_dataset(directory, reservation_count, room_count)
+            finally:
+                shutil.rmtree(directory)
+            run['datasets'].append({'reservations': reservation_count, 'rooms': room_count, 'operations': results})
+            for name, result in results.items():
+                print(f"{reservation_count:>12,} {room_count:>6,}  {name:<30}{result['calls']:>7}{result['errors']:>7}"
+                      f"{result['mean_us'] / 1000:>10.3f}ms{result['peak_memory_bytes'] / 1024:>11,.0f}KiB")
+
+    try:
+        with open(SUITE_RESULTS_FILE, 'r') as file:
+            runs = json.load(file)
+    except FileNotFoundError:
+        runs = []
+    runs.append(run)
+    with open(SUITE_RESULTS_FILE, 'w') as file:
+        json.dump(runs, file, indent=2)
+    print(f"Results appended to {SUITE_RESULTS_FILE}.")
+
+
+# Runs in a worker process of the shared benchmark. It loads the hotel and attaches to the shared index if asked to,
+# waits at the barrier until every worker is ready, searches random stays for the given number of seconds, then
+# waits for the check event and answers the check stays. Puts the number of searches, how many of them were answered
+# from the process's own index although the shared index was in use, the seconds it took to get ready and the answers
+# to the check stays on the results queue.
+def shared_search_worker(room_file, reservation_file, shared, seconds, check_stays, seed, barrier, check, results):
+    validator = Validator()
+    start = time.perf_counter()
+    room_manager = RoomManager(room_file, validator)
+    reservation_manager = ReservationManager(reservation_file)
+    reader = None
+    if shared:
+        reader = SharedOccupancyReader(reservation_file)
+        room_manager.use_shared_index(reader)
+    room_manager.search_index(reservation_manager)  # Builds the process's own index unless the shared one is used
+    ready_seconds = time.perf_counter() - start
+
+    stays = random_stays(random.Random(seed), 1000)
+    searches = fallbacks = 0
+    barrier.wait()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        room_manager.search_cache.clear()
+        room_manager.filter_room_options(*stays[searches % len(stays)], reservation_manager)
+        searches += 1
+        if reader is not None and room_manager.shared_index_failed_at is not None:
+            fallbacks += 1
+
+    check.wait()
+    answers = []
+    for stay in check_stays:
+        room_manager.search_cache.clear()
+        answers.append(room_manager.filter_room_options(*stay, reservation_manager))
+    if reader is not None:
+        reader.close()
+    results.put((searches, fallbacks, ready_seconds, answers))
+
+
+# Books a random stay in the first room that is free for it
+def book_random_stay(hotel_manager, randomiser):
+    check_in_date, check_out_date, num_people = random_stays(randomiser, 1)[0]
+    options = hotel_manager.room_manager.filter_room_options(check_in_date, check_out_date, num_people,
+                                                             hotel_manager.reservation_manager)
+    if options:
+        hotel_manager.make_reservation("Benchmark Guest", num_people, check_in_date, check_out_date, options[0])
+
+
+# Runs the given number of shared_search_worker processes, booking rooms in this process while they search, and
+# checks their answers against this process's own index. Returns the searches per second of all workers together,
+# the slowest worker's time to get ready, the number of searches answered from a worker's own index and the number
+# of workers whose answers didn't match.
+def run_search_workers(hotel_manager, room_file, reservation_file, shared, workers, seconds, check_stays):
+    context = multiprocessing.get_context('spawn')  # Workers load everything themselves, as separate services would
+    barrier = context.Barrier(workers + 1)
+    check = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=shared_search_worker,
+                                 args=(room_file, reservation_file, shared, seconds, check_stays, seed, barrier,
+                                       check, results)) for seed in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        barrier.wait()
+        randomiser = random.Random(workers)
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            try:
+                book_random_stay(hotel_manager, randomiser)
+            except Exception:
+                pass  # A fully booked stay doesn't matter here
+            time.sleep(1 / SHARED_WRITES_PER_SECOND)
+
+        time.sleep(SHARED_WRITER_CATCH_UP_SECONDS)
+        room_manager = hotel_manager.room_manager
+        expected = []
+        for stay in check_stays:
+            room_manager.search_cache.clear()
+            expected.append(room_manager.filter_room_options(*stay, hotel_manager.reservation_manager))
+        check.set()
+        worker_results = [results.get() for _ in processes]
+    finally:
+        for process in processes:
+            process.join()
+    searches = sum(result[0] for result in worker_results)
+    fallbacks = sum(result[1] for result in worker_results)
+    ready_seconds = max(result[2] for result in worker_results)
+    mismatches = sum(result[3] != expected for result in worker_results)
+    return searches / seconds, ready_seconds, fallbacks, mismatches
+
+
+# Compares worker processes that search their own availability index with worker processes that search the index a
+# shared_occupancy.py writer keeps in shared memory, for 1 up to max_workers workers, while this process books rooms.
+# Every worker's answers are checked against this process's own index. The writer is then killed, and the workers
+# have to go back to searching their own index and still give the same answers. Raises AssertionError if any
+# answers differ or the workers didn't notice that the writer had gone.
+def benchmark_shared_index(max_workers=4, reservation_count=200_000, room_count=1_000, seconds=3):
+    directory = tempfile.mkdtemp()
+    room_file = os.path.join(directory, "hotel_room.csv")
+    reservation_file = os.path.join(directory, "reservations.csv")
+    writer = None
+    try:
+        write_synthetic_rooms(room_file, room_count)
+        write_synthetic_reservations(reservation_file, room_count, reservation_count)
+        if os.path.exists("rate_plans.csv"):
+            shutil.copy("rate_plans.csv", directory)
+        hotel_manager = HotelManager(RoomManager(room_file, Validator()), ReservationManager(reservation_file),
+                                     Validator())
+        writer = subprocess.Popen([sys.executable, SHARED_OCCUPANCY_SCRIPT, room_file, reservation_file],
+                                  stdout=subprocess.PIPE, text=True)
+        writer.stdout.readline()  # The writer says when the index is ready
+        check_stays = random_stays(random.Random(-1), SHARED_CHECKS)
+
+        print(f"{reservation_count:,} reservations, {room_count:,} rooms, {seconds}s of searches per run, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'Index':<22}{'Workers':>8}{'Ready':>10}{'Searches/s':>12}{'Fallbacks':>11}{'Mismatches':>12}")
+        runs = [('own', False, workers) for workers in range(1, max_workers + 1)]
+        runs += [('shared', True, workers) for workers in range(1, max_workers + 1)]
+        runs.append(('shared, writer killed', True, max_workers))
+        failures = []
+        for name, shared, workers in runs:
+            if name == 'shared, writer killed':
+                writer.kill()
+                writer.wait()
+            throughput, ready_seconds, fallbacks, mismatches = run_search_workers(
+                hotel_manager, room_file, reservation_file, shared, workers, seconds, check_stays)
+            print(f"{name:<22}{workers:>8}{ready_seconds:>9.2f}s{throughput:>12,.0f}{fallbacks:>11,}"
+                  f"{mismatches:>12}")
+            if mismatches:
+                failures.append(f"{mismatches} of {workers} workers searching the {name} index gave other answers")
+            if name == 'shared' and fallbacks:
+                failures.append(f"{fallbacks} searches of {workers} workers didn't use the shared index")
+            if name == 'shared, writer killed' and not fallbacks:
+                failures.append("The workers kept searching the shared index after its writer was killed")
+        if failures:
+            raise AssertionError('\n'.join(failures))
+    finally:
+        if writer is not None and writer.poll() is None:
+            writer.kill()
+            writer.wait()
+        remove_shared_index(reservation_file)
+        shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    'references': benchmark_references,
+    'dates': benchmark_dates,
+    'startup': benchmark_startup,
+    'suite': benchmark_suite,
+    'shared': benchmark_shared_index,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        counted = '|'.join(name for name in BENCHMARKS if name not in ('suite', 'shared'))
+        print(f"Usage: python benchmarks.py {{{counted}}} [count]\n"
+              f"       python benchmarks.py suite [max reservations] [max rooms]\n"
+              f"       python benchmarks.py shared [max workers] [reservations] [rooms] [seconds]")
+        sys.exit(1)
+    arguments = [int(argument) for argument in sys.argv[2:]]
+    BENCHMARKS[sys.argv[1]](*arguments)
@@ -0,0 +1,267 @@
+# HTTP/JSON booking service for the hotel booking system, so that the web front end can use the same HotelManager as
+# the text console and the GUI. It is built on asyncio from the standard library. All work that touches the
+# reservation files runs on a single worker thread, so the event loop never waits for disk I/O and the managers are
+# only ever used by one thread at a time.
+#
+# Endpoints:
+#   GET    /rooms?check_in=DD/MM/YYYY&check_out=DD/MM/YYYY&num_people=N   search for available rooms
+#   POST   /reservations   {"customer_name", "num_people", "check_in", "check_out", "room_type"[, "room_id"]}
+#   GET    /group_rooms?check_in=DD/MM/YYYY&check_out=DD/MM/YYYY&num_people=N
+#                                                                          cheapest rooms that hold a group
+#   POST   /group_reservations   {"customer_name", "num_people", "check_in", "check_out"}   book a group
+#   GET    /reservations/<reference number>                                look up a reservation
+#   DELETE /reservations/<reference number>                                cancel a reservation
+#   GET    /stats                                                          search cache hit and miss counters,
+#                                                                          and whether the shared index is searched
+#   GET    /metrics[?format=json]                                          performance metrics as Prometheus text
+#                                                                          (recorded when HOTEL_METRICS=1 is set)
+#
+# With --shared-index the service searches the occupancy index a shared_occupancy.py writer keeps for the
+# reservations file instead of building its own, so several services can share one index (see shared_occupancy.py).
+# It falls back to its own index while the writer isn't running.
+#
+# Usage: python booking_service.py [--shared-index] [port] [hotel_room.csv] [reservations.csv]
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from common_functionalities import HotelManager, RoomManager, ReservationManager, Validator
+from metrics import metrics
+from shared_occupancy import SharedOccupancyReader
+
+
+# Raised for requests that should be answered with an HTTP error status rather than a server error
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BookingService:
+    REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+    # Creates the managers the same way the text console does, plus the worker thread for storage work. With
+    # shared_index the room manager searches the shared index of the reservations file, whose writer has to be
+    # running.
+    def __init__(self, room_file_name="hotel_room.csv", reservation_file_name="reservations.csv", shared_index=False):
+        self.validator = Validator()
+        self.hotel_manager = HotelManager(RoomManager(room_file_name, self.validator),
+                                          ReservationManager(reservation_file_name), self.validator)
+        self.shared_index = None
+        if shared_index:
+            try:
+                self.shared_index = SharedOccupancyReader(reservation_file_name)
+            except FileNotFoundError as e:
+                raise Exception(f"An error occurred while attaching to the shared index of {reservation_file_name}. "
+                                f"Start it with: python shared_occupancy.py {room_file_name} "
+                                f"{reservation_file_name}") from e
+            self.hotel_manager.room_manager.use_shared_index(self.shared_index)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    # Runs a blocking HotelManager call on the worker thread and waits for it without blocking the event loop
+    async def run_blocking(self, function, *arguments):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *arguments)
+
+    # Searches for available rooms
+    def search(self, query):
+        try:
+            check_in_date = query['check_in'][0]
+            check_out_date = query['check_out'][0]
+            num_people = int(query.get('num_people', ['1'])[0])
+        except (KeyError, ValueError):
+            raise HttpError(400, "Please give check_in, check_out and num_people.")
+        self.validator.validate_num_people(num_people)
+        self.validator.validate_date_range(check_in_date, check_out_date)
+        return 200, self.hotel_manager.room_manager.filter_room_options(check_in_date, check_out_date, num_people,
+                                                                        self.hotel_manager.reservation_manager)
+
+    # Plans the cheapest rooms for a group without booking them
+    def plan_group(self, query):
+        try:
+            check_in_date = query['check_in'][0]
+            check_out_date = query['check_out'][0]
+            num_people = int(query['num_people'][0])
+        except (KeyError, ValueError):
+            raise HttpError(400, "Please give check_in, check_out and num_people.")
+        self.validator.validate_group_size(num_people)
+        self.validator.validate_date_range(check_in_date, check_out_date)
+        rooms = self.hotel_manager.room_manager.plan_group_rooms(check_in_date, check_out_date, num_people,
+                                                                 self.hotel_manager.reservation_manager)
+        if rooms is None:
+            raise HttpError(404, f"There aren't enough free rooms for a group of {num_people} on these dates.")
+        return 200, rooms
+
+    # Books a group into the cheapest rooms that hold it and returns the rooms with their reference numbers
+    def book_group(self, body):
+        try:
+            booking = json.loads(body)
+            rooms = self.hotel_manager.make_group_reservation(booking['customer_name'], booking['num_people'],
+                                                              booking['check_in'], booking['check_out'])
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            raise HttpError(400, "Please give customer_name, num_people, check_in and check_out as JSON.")
+        return 201, rooms
+
+    # Returns the room ID a booking asks for as an integer, as the room manager keys its rooms, or None if it
+    # doesn't ask for a room
+    def parse_room_id(self, room_id):
+        if room_id is None:
+            return None
+        try:
+            if isinstance(room_id, bool) or not isinstance(room_id, (int, str)):
+                raise TypeError
+            return int(room_id)
+        except (TypeError, ValueError):
+            raise HttpError(400, f"room_id must be a whole number, not {json.dumps(room_id)}.")
+
+    # Books a room and returns the new reservation
+    def book(self, body):
+        try:
+            booking = json.loads(body)
+            selected_room = {'room_type': booking['room_type'], 'room_id': self.parse_room_id(booking.get('room_id'))}
+            reference_number, _ = self.hotel_manager.make_reservation(booking['customer_name'],
+                                                                      booking['num_people'], booking['check_in'],
+                                                                      booking['check_out'], selected_room)
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            raise HttpError(400, "Please give customer_name, num_people, check_in, check_out and room_type as JSON.")
+        return 201, self.hotel_manager.reservation_manager.get(reference_number).to_dict()
+
+    # Looks up a reservation by reference number
+    def lookup(self, reference_number):
+        reservation = self.hotel_manager.reservation_manager.get(reference_number)
+        if reservation is None:
+            raise HttpError(404, f"No reservation found with reference number {reference_number}.")
+        return 200, reservation.to_dict()
+
+    # Cancels a reservation and returns it together with the refund amount
+    def cancel(self, reference_number):
+        reservation = self.hotel_manager.reservation_manager.get(reference_number)
+        if reservation is None:
+            raise HttpError(404, f"No reservation found with reference number {reference_number}.")
+        self.hotel_manager.cancel_reservation(reference_number)
+        result = reservation.to_dict()
+        result['refund'] = self.hotel_manager.calculate_refund(reservation.total_price)
+        return 200, result
+
+    # Returns the search cache counters for monitoring, and whether searches use the shared index or, because it
+    # was last found unavailable, the service's own index
+    def stats(self, _):
+        room_manager = self.hotel_manager.room_manager
+        result = dict(room_manager.search_cache.stats)
+        if self.shared_index is not None:
+            result['shared_index'] = 'unavailable' if room_manager.shared_index_failed_at is not None else 'in use'
+        return 200, result
+
+    # Returns the performance metrics as Prometheus text, or as JSON if asked for
+    def performance_metrics(self, query):
+        if query.get('format', [''])[0] == 'json':
+            return 200, metrics.to_dict()
+        return 200, metrics.to_prometheus()
+
+    # Picks the handler for a request. Returns the handler and its arguments, to be run on the worker thread.
+    def route(self, method, target, body):
+        url = urlsplit(target)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['rooms']:
+            if method != 'GET':
+                raise HttpError(405, "Use GET to search for rooms.")
+            return self.search, parse_qs(url.query)
+        if parts == ['stats']:
+            if method != 'GET':
+                raise HttpError(405, "Use GET to read the statistics.")
+            return self.stats, None
+        if parts == ['metrics']:
+            if method != 'GET':
+                raise HttpError(405, "Use GET to read the metrics.")
+            return self.performance_metrics, parse_qs(url.query)
+        if parts == ['group_rooms']:
+            if method != 'GET':
+                raise HttpError(405, "Use GET to plan rooms for a group.")
+            return self.plan_group, parse_qs(url.query)
+        if parts == ['group_reservations']:
+            if method != 'POST':
+                raise HttpError(405, "Use POST to book a group.")
+            return self.book_group, body
+        if parts == ['reservations']:
+            if method != 'POST':
+                raise HttpError(405, "Use POST to make a reservation.")
+            return self.book, body
+        if len(parts) == 2 and parts[0] == 'reservations':
+            if method == 'GET':
+                return self.lookup, parts[1]
+            if method == 'DELETE':
+                return self.cancel, parts[1]
+            raise HttpError(405, "Use GET to look up or DELETE to cancel a reservation.")
+        raise HttpError(404, f"Unknown path '{url.path}'.")
+
+    # Handles one request and returns the status code and the response body: JSON, or plain text if it is a string
+    async def handle_request(self, method, target, body):
+        try:
+            handler, argument = self.route(method, target, body)
+            return await self.run_blocking(handler, argument)
+        except HttpError as e:
+            return e.status, {'error': str(e)}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': str(e)}
+
+    # Serves one client connection. Connections are kept open between requests unless the client asks to close them.
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, result = await self.handle_request(method, target, body)
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and (version == 'HTTP/1.1' or headers.get('connection', '').lower() == 'keep-alive'))
+                if isinstance(result, str):
+                    payload, content_type = result.encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    payload, content_type = json.dumps(result).encode('utf-8'), 'application/json'
+                writer.write(f"HTTP/1.1 {status} {self.REASONS.get(status, '')}\r\n"
+                             f"Content-Type: {content_type}\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+                             + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # The client went away or sent something that isn't HTTP
+        finally:
+            writer.close()
+
+    # Starts listening and serves requests until the task is cancelled
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Booking service listening on http://{host}:{port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != '--shared-index']
+    service_port = int(arguments[0]) if arguments else 8080
+    try:
+        service = BookingService(*arguments[1:3], shared_index='--shared-index' in sys.argv)
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+    try:
+        asyncio.run(service.serve(port=service_port))
+    except KeyboardInterrupt:
+        print("Booking service stopped.")
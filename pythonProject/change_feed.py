@@ -0,0 +1,159 @@
+# Change feed for the hotel booking system, so caches, reports and replicas can follow the reservations
+# incrementally instead of re-reading the whole reservations file. Every reservation a ReservationManager writes or
+# cancels becomes an event:
+#   {"sequence": 42, "type": "created" or "cancelled", "time": "2026-10-17T09:30:00", "reservation": {...}}
+# where the reservation is the full record as Reservation.to_dict gives it. Events are appended to a durable log
+# next to the reservations (reservations.csv.changes, one JSON object per line) and passed to the subscribers in the
+# same process. Events are written while the reservation lock is held, so sequence numbers are shared by every
+# process using the same reservations and the log is in the order the changes were made. A change is logged after it
+# has been saved, so the log never holds a change that didn't happen. Without a log file name the events only go to
+# the subscribers and are numbered by this process alone.
+# The log is written after the reservations, not together with them, so it can miss changes: if a process dies
+# between saving a change and logging it, or the log can't be written, the change is saved but never logged, and
+# nothing in the log shows the gap (the next event simply takes the next sequence number). Publishing never fails the
+# booking or cancellation that was saved; errors are logged instead. Consumers that must not miss a change should
+# check themselves against the reservations from time to time, e.g. with ReservationManager.export_reservations.
+# Consumers keep the byte offset read_events returns and pass it back next time to carry on where they left off.
+# Running this file prints the events of a reservations file as they happen, starting at the given offset:
+#   python change_feed.py reservations.csv [offset]
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    POLL_INTERVAL = 0.5  # Seconds between checks for new events when following the log
+
+    def __init__(self, file_name, fsync_writes=False):
+        self.file_name = file_name
+        self.fsync_writes = fsync_writes
+        self.subscribers = []
+        self.offset = 0  # Number of bytes of the log that this process has read or written
+        self.sequence = 0  # Sequence number of the last event in the log up to the offset
+
+    # Registers a function that is called with every event this process publishes
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    # Returns the events in the log from the byte offset on (as many as 'limit' if given), each with the offset just
+    # after it. A line still being written by another process is left for the next read.
+    def read_events_with_offsets(self, offset=0, limit=None):
+        events = []
+        try:
+            with open(self.file_name, 'rb') as file:
+                file.seek(offset)
+                for line in file:
+                    if not line.endswith(b'\n') or (limit is not None and len(events) >= limit):
+                        break
+                    offset += len(line)
+                    events.append((json.loads(line), offset))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            raise Exception(f"An error occurred while reading the change log '{self.file_name}': {e}") from e
+        return events
+
+    # Returns the events in the log from the byte offset on (as many as 'limit' if given) and the offset to read
+    # the next events from
+    def read_events(self, offset=0, limit=None):
+        events = self.read_events_with_offsets(offset, limit)
+        return [event for event, _ in events], events[-1][1] if events else offset
+
+    # Generates the events from the byte offset on as they are logged, waiting for new ones, each with the offset
+    # to resume from after it
+    def follow(self, offset=0):
+        while True:
+            events = self.read_events_with_offsets(offset)
+            yield from events
+            if events:
+                offset = events[-1][1]
+            else:
+                time.sleep(self.POLL_INTERVAL)
+
+    # Catches up with the events other processes have logged since this process last read or wrote the log, so the
+    # next event gets the next sequence number. Only the new end of the log is read.
+    def catch_up(self):
+        try:
+            size = os.path.getsize(self.file_name)
+        except FileNotFoundError:
+            self.offset, self.sequence = 0, 0
+            return
+        if size < self.offset:  # The log has been truncated or replaced
+            self.offset = 0
+        if size == self.offset:
+            return
+        if self.offset == 0 and size > 65536:
+            # Starting up: only the last event matters, so only the end of a long log is read
+            with open(self.file_name, 'rb') as file:
+                file.seek(size - 65536)
+                data = file.read()
+            data = data[:data.rfind(b'\n') + 1]
+            lines = data.splitlines()
+            self.sequence = json.loads(lines[-1])['sequence'] if lines else self.sequence
+            self.offset = size - 65536 + len(data)
+            return
+        events, self.offset = self.read_events(self.offset)
+        if events:
+            self.sequence = events[-1]['sequence']
+
+    # Logs changes and passes them to the subscribers. 'changes' is a list of ('created' or 'cancelled', reservation
+    # dictionary) pairs. Callers hold the reservation lock and have already saved the changes, so this never raises:
+    # if the log can't be written the changes are left out of it, and a subscriber that fails doesn't stop the others.
+    # Returns the events logged.
+    def publish(self, changes):
+        if not changes:
+            return []
+        try:
+            if self.file_name is not None:
+                self.catch_up()
+        except Exception:
+            logger.exception("Could not read the change log '%s'; the changes are not logged.", self.file_name)
+            return []
+        now = datetime.now().isoformat(timespec='seconds')
+        events = []
+        for sequence, (change_type, reservation) in enumerate(changes, start=self.sequence + 1):
+            events.append({'sequence': sequence, 'type': change_type, 'time': now, 'reservation': reservation})
+        if self.file_name is not None:
+            data = ''.join(json.dumps(event) + '\n' for event in events).encode('utf-8')
+            try:
+                with open(self.file_name, 'ab') as file:
+                    file.write(data)
+                    file.flush()
+                    if self.fsync_writes:
+                        os.fsync(file.fileno())
+            except Exception:
+                logger.exception("Could not write the change log '%s'; the changes are not logged.", self.file_name)
+                try:
+                    os.truncate(self.file_name, self.offset)  # Drops any part of the events that was written
+                except OSError:
+                    self.offset = 0  # The log is read again next time
+                return []
+            self.offset += len(data)
+        self.sequence = events[-1]['sequence']
+
+        for event in events:
+            for subscriber in self.subscribers:
+                try:
+                    subscriber(event)
+                except Exception:
+                    logger.exception("Change feed subscriber %r failed on event %d.", subscriber, event['sequence'])
+        return events
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python change_feed.py <reservations file> [offset]")
+        sys.exit(1)
+    change_feed = ChangeFeed(sys.argv[1] + '.changes')
+    try:
+        for change_event, _ in change_feed.follow(int(sys.argv[2]) if len(sys.argv) > 2 else 0):
+            print(json.dumps(change_event), flush=True)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,286 @@
+# Columnar storage backend for the hotel booking system, for reservation histories too large to handle as Reservation
+# records. ReservationManager uses it when it is given a directory name ending in '.cols'. Every numeric field is
+# kept in its own file as a fixed-width array, so reports can memory-map a column and scan it (with NumPy when it is
+# installed) without parsing or copying it. The files of generation N are:
+#   room_id.N.bin      int32, -1 for reservations made before rooms were allocated individually
+#   check_in.N.bin     int32 day ordinal of the check-in date
+#   check_out.N.bin    int32 day ordinal of the check-out date
+#   total_price.N.bin  float64
+#   details_end.N.bin  int64 offset in details.N.csv where the row's text ends
+#   details.N.csv      side table with the reference number, customer name and room type of every row
+#   cancelled.N.bin    int32 numbers of the rows that have been cancelled
+# All files are append-only. The 'generation' file names the current generation; compaction writes the live rows as
+# the next generation and then switches the 'generation' file over, so readers always see one complete generation.
+# Running this file imports an existing reservations file (CSV or SQLite) into a columnar store:
+#   python columnar_storage.py reservations.csv reservations.cols
+import array
+import csv
+import io
+import mmap
+import os
+import sys
+import tempfile
+from datetime import date
+
+from common_functionalities import Reservation, create_reservation_storage, np
+from metrics import metrics
+
+
+class ColumnarStorage:
+    # Name and array typecode of every fixed-width column. details_end is written last, so its length is the number
+    # of complete rows; anything the other files hold beyond that was left by an interrupted write and is ignored.
+    COLUMNS = (('room_id', 'i'), ('check_in', 'i'), ('check_out', 'i'), ('total_price', 'd'), ('details_end', 'q'))
+
+    def __init__(self, directory, fsync_writes=False, compact_threshold=100):
+        self.directory = directory
+        self.fsync_writes = fsync_writes
+        self.compact_threshold = compact_threshold
+        self.generation = None  # Generation that has been read, None until the store has been loaded
+        self.row_count = 0  # Number of rows that have been read
+        self.tombstone_count = 0  # Number of cancelled rows that have been read
+        self.references = []  # Row number -> reference number, for cancellations made by other processes
+        self.rows = {}  # Reference number -> row number of its live reservation
+
+    # Returns the path of a file of the given generation (the current one by default)
+    def path(self, name, generation=None, extension='.bin'):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"{name}.{generation}{extension}")
+
+    # Reads the current generation from the 'generation' file. A store that doesn't exist yet is at generation 0.
+    def read_generation(self):
+        try:
+            with open(os.path.join(self.directory, 'generation'), 'r') as file:
+                return int(file.read())
+        except FileNotFoundError:
+            return 0
+
+    # Returns the number of items of the given size in a file, 0 if it doesn't exist yet
+    def read_length(self, file_name, item_size):
+        try:
+            return os.path.getsize(file_name) // item_size
+        except FileNotFoundError:
+            return 0
+
+    # Reads items start to stop of a fixed-width column file into an array
+    def read_column(self, file_name, typecode, start, stop):
+        values = array.array(typecode)
+        if stop > start:
+            with open(file_name, 'rb') as file:
+                file.seek(start * values.itemsize)
+                values.frombytes(file.read((stop - start) * values.itemsize))
+            metrics.add('storage.read', bytes_read=(stop - start) * values.itemsize)
+        return values
+
+    # Reads rows start to stop as Reservation records and records their reference numbers
+    def read_rows(self, start, stop):
+        columns = {name: self.read_column(self.path(name), typecode, start, stop)
+                   for name, typecode in self.COLUMNS}
+        details_start = self.read_column(self.path('details_end'), 'q', start - 1, start)[0] if start else 0
+        details_stop = columns['details_end'][-1] if stop > start else details_start
+        with open(self.path('details', extension='.csv'), 'rb') as file:
+            file.seek(details_start)
+            details = list(csv.reader(io.StringIO(file.read(details_stop - details_start).decode('utf-8'),
+                                                  newline='')))
+        metrics.add('storage.read', rows=stop - start, bytes_read=details_stop - details_start)
+
+        # Most reservations share a few hundred distinct dates, so each date object is only created once
+        days = {ordinal: date.fromordinal(ordinal) for ordinal in set(columns['check_in']).union(columns['check_out'])}
+        reservations = []
+        for (reference_number, customer_name, room_type), room_id, check_in, check_out, total_price in zip(
+                details, columns['room_id'], columns['check_in'], columns['check_out'], columns['total_price']):
+            reservations.append(Reservation(reference_number, customer_name, room_type, days[check_in],
+                                            days[check_out], total_price, None if room_id < 0 else room_id))
+            self.references.append(reference_number)
+        return reservations
+
+    # Reads the live reservations as Reservation records. A missing store simply means there are no reservations yet.
+    @metrics.instrumented('storage.load')
+    def load(self):
+        self.generation = self.read_generation()
+        self.row_count = self.read_length(self.path('details_end'), 8)
+        self.tombstone_count = self.read_length(self.path('cancelled'), 4)
+        self.references = []
+        if not self.row_count:
+            self.rows = {}
+            return []
+        try:
+            reservations = self.read_rows(0, self.row_count)
+            cancelled = set(self.read_column(self.path('cancelled'), 'i', 0, self.tombstone_count))
+        except Exception as e:
+            raise Exception(f"An error occurred while reading the reservation store '{self.directory}': {e}") from e
+        live = [(row, reservation) for row, reservation in enumerate(reservations) if row not in cancelled]
+        self.rows = {reservation.reference_number: row for row, reservation in live}
+        return [reservation for _, reservation in live]
+
+    # Returns the reservations other processes have added and cancelled since the store was last read, as a list of
+    # ('added', Reservation) and ('removed', reference_number) tuples, or None if the store has been compacted since
+    # and has to be loaded again. The files don't record whether a row was added before or after a cancellation, so
+    # the cancellations of rows that had already been read come first, and rows that have been added and cancelled
+    # since are left out. A cancelled stay can never be reported after a new booking of the same room and nights,
+    # which would free those nights again in an availability index.
+    def read_changes(self):
+        if self.generation is None or self.read_generation() != self.generation:
+            return None
+        row_count = self.read_length(self.path('details_end'), 8)
+        tombstone_count = self.read_length(self.path('cancelled'), 4)
+        if row_count == self.row_count and tombstone_count == self.tombstone_count:
+            return []
+
+        reservations = self.read_rows(self.row_count, row_count)
+        changes = []
+        cancelled_new_rows = set()
+        for row in self.read_column(self.path('cancelled'), 'i', self.tombstone_count, tombstone_count):
+            if row >= self.row_count:
+                cancelled_new_rows.add(row)
+                continue
+            reference_number = self.references[row]
+            if self.rows.get(reference_number) == row:
+                del self.rows[reference_number]
+            changes.append(('removed', reference_number))
+        for row, reservation in enumerate(reservations, start=self.row_count):
+            if row not in cancelled_new_rows:
+                self.rows[reservation.reference_number] = row
+                changes.append(('added', reservation))
+        self.row_count, self.tombstone_count = row_count, tombstone_count
+        return changes
+
+    # Appends data to a file of the current generation
+    def append_to_file(self, file_name, data):
+        with open(file_name, 'ab') as file:
+            file.write(data)
+            if self.fsync_writes:
+                file.flush()
+                os.fsync(file.fileno())
+        metrics.add('storage.write', bytes_written=len(data))
+
+    # Appends new reservations to every column. Callers hold the reservation lock and have picked up all changes
+    # made by other processes, so the store holds exactly the rows that have been read. A write that was cut short
+    # earlier may have left extra data at the end of some files, which is cut off first so the columns line up.
+    def append(self, reservations):
+        if not reservations:
+            return
+        if self.generation is None:
+            self.load()
+        os.makedirs(self.directory, exist_ok=True)
+        details_size = self.read_column(self.path('details_end'), 'q', self.row_count - 1,
+                                        self.row_count)[0] if self.row_count else 0
+        for name, typecode in self.COLUMNS:
+            if os.path.exists(self.path(name)):
+                os.truncate(self.path(name), self.row_count * array.array(typecode).itemsize)
+        if os.path.exists(self.path('details', extension='.csv')):
+            os.truncate(self.path('details', extension='.csv'), details_size)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        details = []
+        columns = {name: array.array(typecode) for name, typecode in self.COLUMNS}
+        for reservation in reservations:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([reservation.reference_number, reservation.customer_name, reservation.room_type])
+            row_details = buffer.getvalue().encode('utf-8')
+            details.append(row_details)
+            details_size += len(row_details)
+            columns['room_id'].append(-1 if reservation.room_id is None else reservation.room_id)
+            columns['check_in'].append(reservation.check_in.toordinal())
+            columns['check_out'].append(reservation.check_out.toordinal())
+            columns['total_price'].append(reservation.total_price)
+            columns['details_end'].append(details_size)
+        self.append_to_file(self.path('details', extension='.csv'), b''.join(details))
+        for name, _ in self.COLUMNS:
+            self.append_to_file(self.path(name), columns[name].tobytes())
+
+        for row, reservation in enumerate(reservations, start=self.row_count):
+            self.rows[reservation.reference_number] = row
+            self.references.append(reservation.reference_number)
+        self.row_count += len(reservations)
+        metrics.add('storage.write', rows=len(reservations))
+
+    # Cancels a reservation by appending its row number to the cancelled column, compacting the store once enough
+    # cancelled rows have built up
+    def remove(self, reference_number):
+        row = self.rows.pop(reference_number)
+        self.append_to_file(self.path('cancelled'), array.array('i', [row]).tobytes())
+        self.tombstone_count += 1
+        if self.tombstone_count >= self.compact_threshold:
+            self.compact()
+
+    # Rewrites the live reservations as the next generation and switches over to it, then deletes the files of the
+    # old generation. Processes still reading the old files keep their open copies until they notice the switch.
+    @metrics.instrumented('storage.compact')
+    def compact(self):
+        reservations = self.load()
+        old_generation = self.generation
+        self.generation = old_generation + 1
+        self.row_count, self.tombstone_count = 0, 0
+        self.references, self.rows = [], {}
+        for name, _ in self.COLUMNS:
+            open(self.path(name), 'wb').close()
+        open(self.path('details', extension='.csv'), 'wb').close()
+        self.append(reservations)
+
+        temp_name = None
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as file:
+                temp_name = file.name
+                file.write(str(self.generation))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_name, os.path.join(self.directory, 'generation'))
+        except Exception as e:
+            if temp_name and os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise Exception(f"An error occurred while compacting the reservation store '{self.directory}': {e}") from e
+        for name in [name for name, _ in self.COLUMNS] + ['cancelled']:
+            if os.path.exists(self.path(name, old_generation)):
+                os.remove(self.path(name, old_generation))
+        if os.path.exists(self.path('details', old_generation, '.csv')):
+            os.remove(self.path('details', old_generation, '.csv'))
+
+    # Memory-maps a column of the current generation and returns its first 'length' items without copying them:
+    # a NumPy array when NumPy is installed, otherwise a memoryview of the given typecode
+    def map_column(self, file_name, typecode, length):
+        if not length:
+            return np.zeros(0, dtype=typecode) if np is not None else memoryview(array.array(typecode))
+        with open(file_name, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if np is not None:
+            return np.frombuffer(mapped, dtype=typecode, count=length)
+        return memoryview(mapped)[:length * array.array(typecode).itemsize].cast(typecode)
+
+    # Returns the numeric columns of the whole store for scanning, including cancelled rows, plus 'cancelled' with
+    # the numbers of the cancelled rows. Nothing is parsed or copied, so even millions of rows only cost the memory
+    # the operating system uses to cache the files. The arrays reflect the store as it was when this was called.
+    def read_columns(self):
+        self.generation = self.read_generation() if self.generation is None else self.generation
+        row_count = self.read_length(self.path('details_end'), 8)
+        columns = {name: self.map_column(self.path(name), typecode, row_count)
+                   for name, typecode in self.COLUMNS if name != 'details_end'}
+        columns['cancelled'] = self.map_column(self.path('cancelled'), 'i', self.read_length(self.path('cancelled'), 4))
+        return columns
+
+    def close(self):
+        pass
+
+
+# Imports the reservations of a CSV file or SQLite database into a columnar store. Returns the number imported.
+def migrate_to_columnar(reservation_file_name, directory):
+    reservations = create_reservation_storage(reservation_file_name).load()
+    storage = ColumnarStorage(directory)
+    storage.load()
+    existing = set(storage.rows)
+    new_reservations = [reservation for reservation in reservations if reservation.reference_number not in existing]
+    storage.append(new_reservations)
+    return len(new_reservations)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python columnar_storage.py <reservations.csv|reservations.db> <reservations.cols>")
+        sys.exit(1)
+    try:
+        reservation_count = migrate_to_columnar(*sys.argv[1:])
+        print(f"Imported {reservation_count} reservations into '{sys.argv[2]}'.")
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
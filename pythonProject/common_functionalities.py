@@ -10,19 +10,305 @@
 # the quality of my text console.
 
 import csv
-import random
-import string
-from datetime import datetime
+import gc
+import io
+import json
+import os
+import pickle
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+
+from change_feed import ChangeFeed
+from metrics import metrics
+from pricing import PricingEngine
+
+try:
+    import fcntl
+except ImportError:  # fcntl is only available on Unix-like systems such as macOS and Linux
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the availability calendar falls back to plain Python lists without it
+    np = None
+
+
+# Parses a date in the DD/MM/YYYY format used throughout the program. The format never changes, so splitting the
+# string by hand is much faster than datetime.strptime, and the cache means the same date string (for example the
+# check-in date of a search that is validated, filtered and priced) is only ever parsed once.
+@lru_cache(maxsize=4096)
+def parse_date(date_str):
+    parts = date_str.split('/')
+    if (len(parts) != 3 or not all(part.isascii() and part.isdigit() for part in parts)
+            or not 1 <= len(parts[0]) <= 2 or not 1 <= len(parts[1]) <= 2 or len(parts[2]) != 4):
+        raise ValueError(f"Date '{date_str}' does not match the format DD/MM/YYYY.")
+    day, month, year = parts
+    return date(int(year), int(month), int(day))  # Raises ValueError for dates that don't exist, e.g. 31/02/2024
+
+
+# Returns the value as a date, parsing it first if it is still a DD/MM/YYYY string
+def to_date(value):
+    return value if isinstance(value, date) else parse_date(value)
+
+
+# A single reservation. Rows from the reservations file are parsed once when they are loaded, so the dates are
+# 'date' objects and the price is a float everywhere else in the program. __slots__ keeps each record small when
+# there are many of them in memory.
+class Reservation:
+    __slots__ = ('reference_number', 'customer_name', 'room_type', 'check_in', 'check_out', 'total_price', 'room_id')
+
+    def __init__(self, reference_number, customer_name, room_type, check_in, check_out, total_price, room_id=None):
+        self.reference_number = reference_number
+        self.customer_name = customer_name
+        self.room_type = room_type
+        self.check_in = check_in
+        self.check_out = check_out
+        self.total_price = total_price
+        self.room_id = room_id
+
+    # Creates a reservation from a row of the reservations file. Rows written before rooms were allocated
+    # individually have no room ID.
+    @classmethod
+    def from_row(cls, row):
+        room_id = int(row[6]) if len(row) > 6 and row[6] != '' else None
+        return cls(row[0], row[1], row[2], parse_date(row[3]), parse_date(row[4]), float(row[5]), room_id)
+
+    # Converts the reservation back to a row for the reservations file
+    def to_row(self):
+        return [self.reference_number, self.customer_name, self.room_type, self.check_in_date, self.check_out_date,
+                self.total_price, '' if self.room_id is None else self.room_id]
+
+    # Converts the reservation to a dictionary of plain values, e.g. for JSON
+    def to_dict(self):
+        return {
+            'reference_number': self.reference_number,
+            'customer_name': self.customer_name,
+            'room_type': self.room_type,
+            'room_id': self.room_id,
+            'check_in': self.check_in_date,
+            'check_out': self.check_out_date,
+            'total_price': self.total_price
+        }
+
+    # Key used to filter duplicate reservations: reference number, customer name, room type, check-in and check-out
+    def key(self):
+        return self.reference_number, self.customer_name, self.room_type, self.check_in, self.check_out
+
+    # Check-in date in the DD/MM/YYYY format shown to users
+    @property
+    def check_in_date(self):
+        return self.check_in.strftime('%d/%m/%Y')
+
+    # Check-out date in the DD/MM/YYYY format shown to users
+    @property
+    def check_out_date(self):
+        return self.check_out.strftime('%d/%m/%Y')
+
+    # Number of nights of the stay
+    @property
+    def num_nights(self):
+        return (self.check_out - self.check_in).days
+
+
+# AvailabilityIndex keeps the occupancy of every physical room in memory so that searches don't have to rescan the
+# reservations file. Each room's occupancy is a bitmap (a Python int) where bit i is set when the room is booked for
+# the night starting base_day + i, so checking a stay [check_in, check_out) is a single mask-and-compare per room.
+# Stays can overlap in one room (reservations from before rooms were allocated individually are placed in a room of
+# their type even if none is free), so the index also counts, for the few nights booked more than once, how many
+# extra stays hold them. A cancellation keeps those nights booked and only clears the nights no other stay holds.
+class AvailabilityIndex:
+    def __init__(self, room_types):
+        self.room_types = room_types  # Room type -> room IDs of that type, used to place reservations without a room
+        self.occupancy = {}  # Room ID -> bitmap of booked nights
+        self.base_day = None  # Day ordinal that bit 0 of every bitmap stands for
+        self.stays = {}  # Reference number -> (room_id, check_in, check_out) so a cancellation can clear its nights
+        self.extra_stays = {}  # Room ID -> {day ordinal: number of stays booking that night beyond the first}
+
+    # Returns the bitmap covering the nights of [check_in, check_out). If the stay starts before base_day, every
+    # bitmap is shifted so that base_day moves back to the new check-in.
+    def stay_mask(self, check_in, check_out):
+        if self.base_day is None:
+            self.base_day = check_in
+        elif check_in < self.base_day:
+            shift = self.base_day - check_in
+            self.occupancy = {room_id: bits << shift for room_id, bits in self.occupancy.items()}
+            self.base_day = check_in
+        return ((1 << (check_out - check_in)) - 1) << (check_in - self.base_day)
+
+    # Marks the nights of a stay as booked for the given room. Adding a stay the index already has changes nothing.
+    def add(self, room_id, reference_number, check_in, check_out):
+        stay = (room_id, check_in, check_out)
+        if reference_number in self.stays:
+            if self.stays[reference_number] == stay:
+                return
+            self.remove(reference_number)
+        mask = self.stay_mask(check_in, check_out)  # Worked out first, as it can shift every bitmap
+        bits = self.occupancy.get(room_id, 0)
+        overlap = bits & mask
+        if overlap:
+            extra_stays = self.extra_stays.setdefault(room_id, {})
+            while overlap:
+                lowest = overlap & -overlap
+                night = self.base_day + lowest.bit_length() - 1
+                extra_stays[night] = extra_stays.get(night, 0) + 1
+                overlap ^= lowest
+        self.occupancy[room_id] = bits | mask
+        self.stays[reference_number] = stay
+
+    # Frees the nights booked under the given reference number, if the index knows about it. Nights another stay
+    # still holds stay booked.
+    def remove(self, reference_number):
+        if reference_number not in self.stays:
+            return
+        room_id, check_in, check_out = self.stays.pop(reference_number)
+        mask = self.stay_mask(check_in, check_out)
+        still_booked = 0
+        extra_stays = self.extra_stays.get(room_id)
+        if extra_stays:
+            for night in range(check_in, check_out):
+                count = extra_stays.get(night)
+                if count:
+                    still_booked |= 1 << (night - self.base_day)
+                    if count == 1:
+                        del extra_stays[night]
+                    else:
+                        extra_stays[night] = count - 1
+        self.occupancy[room_id] = (self.occupancy[room_id] & ~mask) | still_booked
+
+    # Returns True if the room has no booked night in [check_in, check_out)
+    def is_free(self, room_id, check_in, check_out):
+        bits = self.occupancy.get(room_id, 0)
+        if not bits:
+            return True
+        # Nights before base_day have never been booked, so only the part of the stay from base_day onwards matters
+        check_in = max(check_in, self.base_day)
+        if check_out <= check_in:
+            return True
+        return not bits & (((1 << (check_out - check_in)) - 1) << (check_in - self.base_day))
+
+    # Returns the room IDs from the given list that are free for the whole stay, keeping their order
+    def free_rooms(self, room_ids, check_in, check_out):
+        return [room_id for room_id in room_ids if self.is_free(room_id, check_in, check_out)]
+
+    # Called by the ReservationManager whenever a new reservation is written. Stays that don't last a night (e.g. a
+    # hand-edited row with the dates the wrong way round) book nothing.
+    def reservation_added(self, reservation):
+        check_in = reservation.check_in.toordinal()
+        check_out = reservation.check_out.toordinal()
+        if check_out <= check_in:
+            return
+        room_id = reservation.room_id
+        if room_id is None:
+            # Reservations made before rooms were allocated individually only record the room type, so they are
+            # placed in the first room of that type that is free for the stay
+            room_ids = self.room_types.get(reservation.room_type)
+            if not room_ids:
+                return
+            free_room_ids = self.free_rooms(room_ids, check_in, check_out)
+            room_id = free_room_ids[0] if free_room_ids else room_ids[0]
+        self.add(room_id, reservation.reference_number, check_in, check_out)
+
+    # Called by the ReservationManager whenever a reservation is cancelled
+    def reservation_removed(self, reservation):
+        self.remove(reservation.reference_number)
+
+
+# SearchCache keeps the results of recent room searches, keyed by check-in and check-out day ordinals and number of
+# people, because front desk and web users keep searching the same few dates. It holds at most MAX_ENTRIES results,
+# dropping the least recently used first, and results older than TTL_SECONDS are searched again. It listens to the
+# ReservationManager like the availability index, and a booking or cancellation only drops the cached searches whose
+# dates overlap the stay, as the others can't have changed. Hits, misses and dropped results are counted in 'stats'.
+class SearchCache:
+    MAX_ENTRIES = 256
+    TTL_SECONDS = 300
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # (check_in, check_out, num_people) -> (time stored, results), oldest use first
+        self.lock = threading.Lock()  # The GUI and the booking service search from worker threads
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0, 'expirations': 0}
+
+    # Returns copies of the cached results of a search, or None if they aren't cached or have expired
+    def get(self, check_in, check_out, num_people):
+        key = (check_in, check_out, num_people)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return [dict(room) for room in entry[1]]
+
+    # Stores the results of a search, dropping the least recently used results if the cache is full
+    def put(self, check_in, check_out, num_people, results):
+        with self.lock:
+            self.entries[(check_in, check_out, num_people)] = (time.monotonic(), [dict(room) for room in results])
+            self.entries.move_to_end((check_in, check_out, num_people))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    # Drops the cached searches for dates that overlap the stay [check_in, check_out)
+    def invalidate(self, check_in, check_out):
+        with self.lock:
+            stale = [key for key in self.entries if key[0] < check_out and key[1] > check_in]
+            for key in stale:
+                del self.entries[key]
+            self.stats['invalidations'] += len(stale)
+
+    # Drops every cached search
+    def clear(self):
+        with self.lock:
+            self.stats['invalidations'] += len(self.entries)
+            self.entries.clear()
+
+    # Called by the ReservationManager whenever a new reservation is written
+    def reservation_added(self, reservation):
+        self.invalidate(reservation.check_in.toordinal(), reservation.check_out.toordinal())
+
+    # Called by the ReservationManager whenever a reservation is cancelled
+    def reservation_removed(self, reservation):
+        self.invalidate(reservation.check_in.toordinal(), reservation.check_out.toordinal())
+
 
 # RoomManager class manages rooms in the hotel
 class RoomManager:
-    # Upon initialization, the RoomManager reads room data from a CSV file and stores it in a dictionary.
+    SHARED_INDEX_RETRY_SECONDS = 5  # How long searches use the process's own index after the shared one failed
+
+    # Upon initialization, the RoomManager reads room data from a CSV file and stores it in a dictionary of physical
+    # rooms, then groups the room IDs by room type for searching and allocation.
+    # The rate plans are read from rate_plans.csv in the same directory as the room file.
     def __init__(self, file_name, validator):
         self.rooms = self.read_room_data(file_name)
+        self.room_types = self.group_rooms_by_type()
         self.validator = validator
+        self.pricing_engine = PricingEngine.for_room_file(file_name)
+        self.search_cache = SearchCache()
+        self.availability_index = None
+        self.indexed_reservation_manager = None
+        self.shared_index = None  # Shared occupancy index searched instead, if this process reads one
+        self.shared_index_version = None
+        self.shared_index_failed_at = None  # When the shared index was last found unavailable
 
     def read_room_data(self, file_name):
-        # This method reads room data from a CSV file and organizes it into a dictionary.
+        # This method reads room data from a CSV file and organizes it into a dictionary keyed by room ID, so that every
+        # room in the hotel can be booked instead of only the cheapest room of each type. Rooms can also be read
+        # from the rooms table of a SQLite database.
+        if is_sqlite_file(file_name):
+            from sqlite_storage import SqliteStorage
+            return SqliteStorage(file_name).read_rooms()
         rooms = {}
         try:
             with open(file_name, 'r', newline='') as file:
@@ -35,115 +321,816 @@ class RoomManager:
                     max_people = int(max_people)
                     price_per_night = float(price_per_night)
                     # Stores room details in the dictionary
-                    if room_type not in rooms:
-                        rooms[room_type] = {'room_id': room_id, 'price_per_night': price_per_night,
-                                            'max_people': max_people}
-                    else:
-                        if price_per_night < rooms[room_type]['price_per_night']:
-                            rooms[room_type] = {'room_id': room_id, 'price_per_night': price_per_night,
-                                                'max_people': max_people}
+                    rooms[room_id] = {'room_id': room_id, 'room_type': room_type, 'price_per_night': price_per_night,
+                                      'max_people': max_people}
             return rooms
         except FileNotFoundError as e:
             raise FileNotFoundError(f"Error: File '{file_name}' not found.") from e
         except Exception as e:
             raise Exception(f"An error occurred while reading the file '{file_name}': {e}") from e
 
+    # Groups room IDs by room type in the order the types first appear in the file. Within a type the cheapest rooms
+    # come first, so the allocator always hands out the cheapest free room.
+    def group_rooms_by_type(self):
+        room_types = {}
+        for room_id, room_info in self.rooms.items():
+            room_types.setdefault(room_info['room_type'], []).append(room_id)
+        for room_ids in room_types.values():
+            room_ids.sort(key=lambda room_id: (self.rooms[room_id]['price_per_night'], room_id))
+        return room_types
+
+    @metrics.instrumented('filter_room_options')
     def filter_room_options(self, check_in_date, check_out_date, num_people, reservation_manager):
-        # Ensures that check_in_date and check_out_date are in the correct format
-        self.validator.validate_date_format(check_in_date)
-        self.validator.validate_date_format(check_out_date)
-
-        # Converts check_in_date and check_out_date to datetime.date objects
-        check_in_date = datetime.strptime(check_in_date, '%d/%m/%Y').date()
-        check_out_date = datetime.strptime(check_out_date, '%d/%m/%Y').date()
-
-        # Retrieves reservations
-        reservations = reservation_manager.read_reservation_data()
-
-        # Filters available rooms using list comprehensions
-        available_rooms = [{
-            'room_number': i + 1,
-            'room_id': room_info['room_id'],
-            'room_type': room_type,
-            'price_per_night': room_info['price_per_night']
-        } for i, (room_type, room_info) in enumerate(self.rooms.items())
-            if room_info['max_people'] >= num_people
-            and room_type not in {res[2] for res in reservations
-                                  if datetime.strptime(res[3], '%d/%m/%Y').date() <= check_out_date
-                                  and datetime.strptime(res[4], '%d/%m/%Y').date() >= check_in_date}
-        ]
+        # Ensures that check_in_date and check_out_date are in the correct format and make a valid stay, and converts
+        # them to the day ordinals used by the availability index
+        check_in, check_out = self.validator.validate_date_range(check_in_date, check_out_date)
+        check_in, check_out = check_in.toordinal(), check_out.toordinal()
+
+        # Retrieves the availability index instead of re-reading every reservation. This also picks up changes made
+        # by other processes, which drops the cached searches they affect.
+        availability_index = self.search_index(reservation_manager)
+        num_people = int(num_people)
+        available_rooms = self.search_cache.get(check_in, check_out, num_people)
+        if available_rooms is not None:
+            return available_rooms
 
+        # Lists one option per room type, offering the cheapest free room of that type, how many are left and the
+        # price of the whole stay in it. How many rooms of the type are taken feeds the occupancy pricing rules.
+        metrics.add('filter_room_options', rows=len(self.rooms))
+        available_rooms = []
+        for i, (room_type, room_ids) in enumerate(self.room_types.items()):
+            free_room_ids = availability_index.free_rooms(room_ids, check_in, check_out)
+            occupancy = 1 - len(free_room_ids) / len(room_ids)
+            free_room_ids = self.rooms_for_party(free_room_ids, num_people)
+            if free_room_ids:
+                room_info = self.rooms[free_room_ids[0]]
+                available_rooms.append({
+                    'room_number': i + 1,
+                    'room_id': room_info['room_id'],
+                    'room_type': room_type,
+                    'price_per_night': room_info['price_per_night'],
+                    'available_count': len(free_room_ids),
+                    'total_price': self.pricing_engine.quote(room_type, room_info['price_per_night'], check_in,
+                                                             check_out, occupancy)
+                })
+
+        self.search_cache.put(check_in, check_out, num_people, available_rooms)
         return available_rooms
 
-# Manages hotel reservations
-class ReservationManager:
+    # Counts the free rooms of every type for the given dates, including types that are fully booked
+    def count_free_rooms(self, check_in_date, check_out_date, reservation_manager, num_people=1):
+        check_in = self.validator.validate_date_format(check_in_date).toordinal()
+        check_out = self.validator.validate_date_format(check_out_date).toordinal()
+
+        availability_index = self.search_index(reservation_manager)
+        return {room_type: len(availability_index.free_rooms(self.rooms_for_party(room_ids, num_people), check_in,
+                                                             check_out))
+                for room_type, room_ids in self.room_types.items()}
+
+    # Assigns a concrete room of the requested type that is free for the whole stay and fits the party. The
+    # preferred room (usually the one shown in the search results) is tried first, then the cheapest free room.
+    # The dates can be DD/MM/YYYY strings or already parsed dates.
+    def allocate_room(self, room_type, check_in_date, check_out_date, num_people, reservation_manager,
+                      preferred_room_id=None):
+        check_in = to_date(check_in_date).toordinal()
+        check_out = to_date(check_out_date).toordinal()
+
+        availability_index = self.get_availability_index(reservation_manager)
+        room_ids = self.rooms_for_party(self.room_types.get(room_type, []), num_people)
+        if preferred_room_id in room_ids:
+            room_ids = [preferred_room_id] + [room_id for room_id in room_ids if room_id != preferred_room_id]
+        for room_id in room_ids:
+            if availability_index.is_free(room_id, check_in, check_out):
+                return self.rooms[room_id]
+        raise ValueError(f"Sorry, no {room_type} room is available for the selected dates.")
+
+    # Counts the free rooms of every type for each night from start_date up to (but not including) end_date, e.g. to
+    # show a month view. Returns a dictionary of room type -> list of free counts, where item i is the night starting
+    # start_date + i days. Instead of checking every night separately, each booked stay in the window is recorded in a
+    # difference array (-1 on its first night, +1 after its last) and a running total over the array gives the number
+    # of booked rooms per night, so the whole calendar takes one pass over the reservations. The dates can be
+    # DD/MM/YYYY strings or already parsed dates.
+    def availability_calendar(self, start_date, end_date, num_people, reservation_manager):
+        start = to_date(start_date).toordinal()
+        end = to_date(end_date).toordinal()
+        if end <= start:
+            raise ValueError("The end date must be after the start date.")
+        num_nights = end - start
+
+        # Works out which calendar row each room that fits the party counts towards
+        availability_index = self.get_availability_index(reservation_manager)
+        room_types = list(self.room_types)
+        row_of_room = {}
+        room_counts = []
+        for row, room_ids in enumerate(self.room_types.values()):
+            party_room_ids = self.rooms_for_party(room_ids, num_people)
+            room_counts.append(len(party_room_ids))
+            for room_id in party_room_ids:
+                row_of_room[room_id] = row
+
+        # Clips every stay that overlaps the window to the window
+        rows, firsts, lasts = [], [], []
+        for room_id, check_in, check_out in availability_index.stays.values():
+            row = row_of_room.get(room_id)
+            if row is not None and check_in < end and check_out > start:
+                rows.append(row)
+                firsts.append(max(check_in, start) - start)
+                lasts.append(min(check_out, end) - start)
+
+        # Counts below zero can only come from old double bookings in the file, so they are shown as no free rooms
+        if np is not None:
+            changes = np.zeros((len(room_types), num_nights + 1), dtype=np.int64)
+            np.add.at(changes, (np.array(rows, dtype=np.intp), np.array(firsts, dtype=np.intp)), -1)
+            np.add.at(changes, (np.array(rows, dtype=np.intp), np.array(lasts, dtype=np.intp)), 1)
+            free_counts = np.cumsum(changes[:, :num_nights], axis=1) + np.array(room_counts, dtype=np.int64)[:, None]
+            np.maximum(free_counts, 0, out=free_counts)
+            return {room_type: free_counts[row].tolist() for row, room_type in enumerate(room_types)}
+
+        changes = [[0] * (num_nights + 1) for _ in room_types]
+        for row, first, last in zip(rows, firsts, lasts):
+            changes[row][first] -= 1
+            changes[row][last] += 1
+        return {room_type: [max(free_count, 0) for free_count in
+                            accumulate(changes[row][:num_nights], initial=room_counts[row])][1:]
+                for row, room_type in enumerate(room_types)}
+
+    # Finds the first stay of the given number of nights, starting on or after start_date (today by default) and
+    # within search_days days, for which one room of the type is free every night. Returns the room in the format
+    # used by filter_room_options together with the check-in and check-out dates, or None if there is no such stay.
+    # Nights where the calendar shows no free room rule out a stay straight away; for the rest the availability
+    # index checks that a single room is free for the whole stay, as guests can't change rooms halfway through.
+    def next_available_window(self, room_type, num_nights, num_people, reservation_manager, start_date=None,
+                              search_days=365):
+        if room_type not in self.room_types:
+            raise ValueError(f"Unknown room type '{room_type}'.")
+        if int(num_nights) < 1:
+            raise ValueError("The number of nights must be at least 1.")
+        num_nights = int(num_nights)
+        start = to_date(start_date) if start_date is not None else date.today()
+        free_counts = self.availability_calendar(start, start + timedelta(days=search_days + num_nights), num_people,
+                                                 reservation_manager)[room_type]
+
+        availability_index = self.availability_index
+        room_ids = self.rooms_for_party(self.room_types[room_type], num_people)
+        nights_in_a_row = 0
+        for night, free_count in enumerate(free_counts):
+            nights_in_a_row = nights_in_a_row + 1 if free_count else 0
+            if nights_in_a_row < num_nights:
+                continue
+            check_in = start.toordinal() + night - num_nights + 1
+            free_room_ids = availability_index.free_rooms(room_ids, check_in, check_in + num_nights)
+            if free_room_ids:
+                room_info = self.rooms[free_room_ids[0]]
+                return {
+                    'room_id': room_info['room_id'],
+                    'room_type': room_type,
+                    'price_per_night': room_info['price_per_night'],
+                    'check_in_date': date.fromordinal(check_in).strftime('%d/%m/%Y'),
+                    'check_out_date': date.fromordinal(check_in + num_nights).strftime('%d/%m/%Y')
+                }
+        return None
+
+    # Returns the fraction of the rooms of a type that are taken for at least one night of the stay, which the
+    # occupancy pricing rules use. The dates can be DD/MM/YYYY strings or already parsed dates.
+    def stay_occupancy(self, room_type, check_in_date, check_out_date, reservation_manager):
+        room_ids = self.room_types.get(room_type)
+        if not room_ids:
+            return 0.0
+        availability_index = self.get_availability_index(reservation_manager)
+        free_room_ids = availability_index.free_rooms(room_ids, to_date(check_in_date).toordinal(),
+                                                      to_date(check_out_date).toordinal())
+        return 1 - len(free_room_ids) / len(room_ids)
+
+    # Works out the cheapest set of rooms that are free for the whole stay and together hold a group of num_people,
+    # for groups too large for one room. Free rooms with the same capacity and price for the stay are
+    # interchangeable, so they are counted as one kind of room and the choice is a bounded knapsack over the kinds:
+    # each kind is split into bundles of 1, 2, 4, ... rooms, and a table over the number of guests held keeps the
+    # cheapest way (then the one with the fewest rooms) to hold them. That takes milliseconds even for hundreds of
+    # rooms. The rooms are priced at the occupancy before the group is booked.
+    # Returns the rooms as dictionaries with the room_id, room_type, max_people, the number of guests placed in it
+    # and the total_price of the stay, or None if the free rooms can't hold the whole group.
+    def plan_group_rooms(self, check_in_date, check_out_date, num_people, reservation_manager):
+        check_in = to_date(check_in_date).toordinal()
+        check_out = to_date(check_out_date).toordinal()
+        num_people = int(num_people)
+        availability_index = self.get_availability_index(reservation_manager)
+
+        # Groups the free rooms by capacity and price of the stay, in cents so prices compare exactly
+        kinds = {}
+        for room_type, room_ids in self.room_types.items():
+            free_room_ids = availability_index.free_rooms(room_ids, check_in, check_out)
+            occupancy = 1 - len(free_room_ids) / len(room_ids)
+            for room_id in free_room_ids:
+                room_info = self.rooms[room_id]
+                total_price = self.pricing_engine.quote(room_type, room_info['price_per_night'], check_in, check_out,
+                                                        occupancy)
+                kinds.setdefault((room_info['max_people'], round(total_price * 100)), []).append(room_id)
+
+        # Any number of rooms of a kind can be made up from its bundles, so each bundle is used at most once
+        bundles = []
+        for kind, room_ids in kinds.items():
+            remaining, size = len(room_ids), 1
+            while remaining:
+                size = min(size, remaining)
+                bundles.append((kind, size))
+                remaining -= size
+                size *= 2
+
+        # best[held] is the (price in cents, number of rooms) of the cheapest rooms found that hold 'held' guests,
+        # where holding more guests than the group counts as holding num_people. sources[i][held] is the entry the
+        # bundle i was added to when it improved best[held], so the chosen bundles can be traced back.
+        best = [(0, 0)] + [None] * num_people
+        sources = []
+        for (max_people, price), size in bundles:
+            source = {}
+            for held in range(num_people - 1, -1, -1):
+                if best[held] is None:
+                    continue
+                target = min(num_people, held + max_people * size)
+                candidate = (best[held][0] + price * size, best[held][1] + size)
+                if best[target] is None or candidate < best[target]:
+                    best[target] = candidate
+                    source[target] = held
+            sources.append(source)
+        if best[num_people] is None:
+            return None
+
+        counts = {}
+        held = num_people
+        for (kind, size), source in zip(reversed(bundles), reversed(sources)):
+            if held in source:
+                counts[kind] = counts.get(kind, 0) + size
+                held = source[held]
+
+        rooms = []
+        for (max_people, price), count in counts.items():
+            for room_id in kinds[(max_people, price)][:count]:
+                room_info = self.rooms[room_id]
+                rooms.append({'room_id': room_id, 'room_type': room_info['room_type'], 'max_people': max_people,
+                              'guests': 0, 'total_price': price / 100})
+        # Places the guests in the largest rooms first
+        rooms.sort(key=lambda room: (-room['max_people'], room['total_price'], room['room_id']))
+        unplaced = num_people
+        for room in rooms:
+            room['guests'] = min(room['max_people'], unplaced)
+            unplaced -= room['guests']
+        return rooms
+
+    # Keeps only the rooms that can hold the given number of people
+    def rooms_for_party(self, room_ids, num_people):
+        return [room_id for room_id in room_ids if self.rooms[room_id]['max_people'] >= int(num_people)]
+
+    # Makes searches (filter_room_options and count_free_rooms) read the occupancy from a SharedOccupancyReader (see
+    # shared_occupancy.py) instead of this process building its own availability index, so worker processes that
+    # only search never load the reservations. Bookings still check the rooms with the process's own index.
+    def use_shared_index(self, shared_index):
+        self.shared_index = shared_index
+        self.shared_index_version = None
+        self.shared_index_failed_at = None
+        self.search_cache.clear()
+
+    # Returns the index searches are answered from: the shared index if there is one, otherwise the process's own
+    # availability index. The search cache isn't told about changes in the shared index, so it is cleared whenever
+    # the shared index has changed. While the shared index is unavailable (e.g. its writer has stopped) the process's
+    # own index is searched, and the shared index is tried again every SHARED_INDEX_RETRY_SECONDS.
+    def search_index(self, reservation_manager):
+        if self.shared_index is None or (self.shared_index_failed_at is not None and time.monotonic()
+                                         - self.shared_index_failed_at < self.SHARED_INDEX_RETRY_SECONDS):
+            return self.get_availability_index(reservation_manager)
+        from shared_occupancy import SharedIndexUnavailable
+        try:
+            version = self.shared_index.version()
+        except SharedIndexUnavailable:
+            self.shared_index_failed_at = time.monotonic()
+            self.shared_index_version = None
+            self.search_cache.clear()  # The cached results came from the shared index
+            return self.get_availability_index(reservation_manager)
+        self.shared_index_failed_at = None
+        if version != self.shared_index_version:
+            self.search_cache.clear()
+            self.shared_index_version = version
+        return self.shared_index
+
+    # Builds the availability index from the reservation manager's data the first time it is searched, then subscribes
+    # the index and the search cache to the manager so bookings and cancellations keep them up to date without
+    # another full read. Every call also picks up bookings made by other processes, which usually costs no more than
+    # checking the file size.
+    def get_availability_index(self, reservation_manager):
+        with reservation_manager.read_lock:
+            reservation_manager.refresh()
+            if self.indexed_reservation_manager is not reservation_manager:
+                availability_index = AvailabilityIndex(self.room_types)
+                for reservation in reservation_manager.reservations.values():
+                    availability_index.reservation_added(reservation)
+                reservation_manager.add_listener(availability_index)
+                self.search_cache.clear()
+                reservation_manager.add_listener(self.search_cache)
+                self.availability_index = availability_index
+                self.indexed_reservation_manager = reservation_manager
+        return self.availability_index
+
+
+# Returns True if the file name points to a SQLite database rather than a CSV file
+def is_sqlite_file(file_name):
+    return os.path.splitext(file_name)[1].lower() in ('.db', '.sqlite', '.sqlite3')
+
+
+# Returns True if the file name points to a columnar reservation store (a directory ending in '.cols')
+def is_columnar_store(file_name):
+    return file_name.rstrip('/\\').lower().endswith('.cols')
+
+
+# Creates the storage backend for a reservations file: SQLite for database files, the columnar store for '.cols'
+# directories and CSV for everything else. The SQLite and columnar backends are only imported when they are used.
+def create_reservation_storage(file_name, fsync_writes=False, compact_threshold=100):
+    if is_sqlite_file(file_name):
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(file_name)
+    if is_columnar_store(file_name):
+        from columnar_storage import ColumnarStorage
+        return ColumnarStorage(file_name, fsync_writes, compact_threshold)
+    return CsvReservationStorage(file_name, fsync_writes, compact_threshold)
+
+
+# Lock shared by every process working on the same data file, held with fcntl.flock on a '.lock' file next to it so
+# that the console and the GUI can't change the reservations at the same time. Using the lock itself takes it
+# exclusively, for changes; 'shared' takes it shared, so any number of processes can read while nobody changes the
+# data, and 'local' only locks out the other threads of this process, for storages that can be read while another
+# process changes them. Threads of one process share it through a re-entrant lock, so code that already holds it can
+# take it again; taking it exclusively while holding it shared upgrades it until it is released. The lock file is
+# opened once and kept open. Where fcntl isn't available (Windows) only threads of the same process are locked out.
+class FileLock:
     def __init__(self, file_name):
+        self.lock_file_name = file_name + '.lock'
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+        self.held = None  # fcntl.LOCK_EX or fcntl.LOCK_SH while this process holds the file lock
+        self.shared = FileLockMode(self, fcntl.LOCK_SH if fcntl is not None else None)
+        self.local = FileLockMode(self, None)
+
+    # Takes the lock in the given mode: fcntl.LOCK_EX, fcntl.LOCK_SH or None for the thread lock only
+    def acquire(self, mode):
+        self.thread_lock.acquire()
+        try:
+            if mode is not None and fcntl is not None and self.held != fcntl.LOCK_EX and self.held != mode:
+                if self.lock_file is None:
+                    self.lock_file = open(self.lock_file_name, 'a')
+                fcntl.flock(self.lock_file, mode)
+                self.held = mode
+        except Exception:
+            self.thread_lock.release()
+            raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.held is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.held = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire(fcntl.LOCK_EX if fcntl is not None else None)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    # Closes the lock file. The lock can't be held at the time.
+    def close(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+# Takes a FileLock in another mode than exclusively, as a context manager
+class FileLockMode:
+    def __init__(self, file_lock, mode):
+        self.file_lock = file_lock
+        self.mode = mode
+
+    def __enter__(self):
+        self.file_lock.acquire(self.mode)
+        return self.file_lock
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file_lock.release()
+
+
+# Stores reservations in a CSV file used as an append-only log. New reservations are appended and cancellations are
+# appended as tombstone rows, so neither has to rewrite the file. With fsync_writes=True every write is also flushed
+# to disk before returning, trading some booking latency for durability if the machine loses power. Once
+# compact_threshold tombstones have built up the file is compacted.
+# The storage remembers how far into the file it has read, so changes appended by other processes can be picked up
+# by reading only the new bytes at the end. Rows are only ever appended whole lines at a time and the file is only
+# replaced by renaming a complete one over it, so it can be read without locking out writers (LOCK_FREE_READS): a
+# row still being appended is left for the next read.
+class CsvReservationStorage:
+    LOCK_FREE_READS = True
+    HEADER = ['Reference Number', 'Customer Name', 'Room Type', 'Check In', 'Check Out', 'Total Price', 'Room ID']
+    # First column of a tombstone row, which marks the reference number in the second column as cancelled
+    TOMBSTONE = '#cancelled'
+    # Changes the snapshot format, so snapshots written by older versions are ignored instead of misread
+    SNAPSHOT_VERSION = 1
+    # Number of rows appended after the snapshot that are replayed on startup before the snapshot is written again
+    SNAPSHOT_JOURNAL_ROWS = 1000
+
+    def __init__(self, file_name, fsync_writes=False, compact_threshold=100):
         self.file_name = file_name
+        self.snapshot_file_name = file_name + '.snapshot'
+        self.fsync_writes = fsync_writes
+        self.compact_threshold = compact_threshold
+        self.tombstone_count = 0
+        self.offset = 0  # Number of bytes of the file that have been read
+        # Inode, size and modification time of the file when it was last read or written. If they are unchanged,
+        # nobody else has touched the file; a different inode means another process has compacted it.
+        self.file_stat = None
+        # Last bytes read before the offset. Inode numbers can be reused after a file is replaced, so these are
+        # compared as well to make sure the file still starts the way it did when it was read.
+        self.tail = b''
 
-    # Reads reservation data from csv file
-    def read_reservation_data(self):
-        reservations = []
+    # Reads the live reservations as Reservation records. A missing file simply means there are no reservations yet.
+    # The reservations file is an append-only journal, so when a snapshot of the parsed reservations exists only the
+    # rows appended after it are read; otherwise the whole file is read and a snapshot is written for next time.
+    @metrics.instrumented('storage.load')
+    def load(self):
+        if not os.path.exists(self.file_name):
+            self.offset, self.file_stat, self.tail = 0, None, b''
+            return []
+        reservations = self.load_snapshot()
+        if reservations is None:
+            reservations, self.tombstone_count = self.read_reservation_log()
+            self.write_snapshot(reservations)
+        return reservations
+
+    # Loads the reservations from the snapshot file and replays the rows appended to the reservations file since it
+    # was written. Returns None if there is no usable snapshot, for example because the reservations file has been
+    # compacted or edited by hand since, in which case the whole file has to be read.
+    def load_snapshot(self):
         try:
-            with open(self.file_name, 'r', newline='') as file:
-                reader = csv.reader(file)
-                next(reader)  # Skip header row
-                for row in reader:
-                    reservations.append(row)
-            return reservations
+            with open(self.snapshot_file_name, 'rb') as file:
+                snapshot = pickle.load(file)
+                metrics.add('storage.load', bytes_read=file.tell())
+            if snapshot['version'] != self.SNAPSHOT_VERSION:
+                return None
+            self.file_stat, self.offset, self.tail = snapshot['file_stat'], snapshot['offset'], snapshot['tail']
+            self.tombstone_count = snapshot['tombstone_count']
+            changes = self.read_changes()  # Checks the file still starts with what the snapshot was taken from
+        except Exception:
+            return None  # A missing, damaged or unreadable snapshot is simply rebuilt from the reservations file
+        if changes is None:
+            return None
+
+        # The snapshot stores each field as a column. Most reservations share a few hundred distinct dates, so each
+        # date object is only created once, and map() builds the records without a Python-level loop.
+        references, customer_names, room_types, check_ins, check_outs, total_prices, room_ids = snapshot['columns']
+        days = {ordinal: date.fromordinal(ordinal) for ordinal in set(check_ins).union(check_outs)}
+        reservations = dict(zip(references, map(Reservation, references, customer_names, room_types,
+                                                map(days.__getitem__, check_ins), map(days.__getitem__, check_outs),
+                                                total_prices, room_ids)))
+        for change, value in changes:
+            if change == 'added':
+                reservations[value.reference_number] = value
+            else:
+                reservations.pop(value, None)
+        reservations = list(reservations.values())
+        if len(changes) >= self.SNAPSHOT_JOURNAL_ROWS:
+            self.write_snapshot(reservations)
+        return reservations
+
+    # Saves the parsed reservations together with how far into the reservations file they were read. The snapshot
+    # is written to a temporary file and renamed into place, so other processes never see half of one. Failing to
+    # write it only makes the next startup slower, so errors are ignored.
+    def write_snapshot(self, reservations):
+        snapshot = {
+            'version': self.SNAPSHOT_VERSION,
+            'file_stat': self.file_stat,
+            'offset': self.offset,
+            'tail': self.tail,
+            'tombstone_count': self.tombstone_count,
+            'columns': ([reservation.reference_number for reservation in reservations],
+                        [reservation.customer_name for reservation in reservations],
+                        [reservation.room_type for reservation in reservations],
+                        [reservation.check_in.toordinal() for reservation in reservations],
+                        [reservation.check_out.toordinal() for reservation in reservations],
+                        [reservation.total_price for reservation in reservations],
+                        [reservation.room_id for reservation in reservations])
+        }
+        directory = os.path.dirname(os.path.abspath(self.snapshot_file_name))
+        temp_name = None
+        try:
+            with tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.tmp', delete=False) as file:
+                temp_name = file.name
+                pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, self.snapshot_file_name)
+        except OSError:
+            if temp_name and os.path.exists(temp_name):
+                os.remove(temp_name)
+
+    # Reads every row of the reservations file and applies the tombstones in it. A tombstone cancels the rows with
+    # its reference number that come before it. Returns the live reservations and the number of tombstones found.
+    def read_reservation_log(self):
+        rows = []
+        cancelled_at = {}  # Reference number -> position of its latest tombstone
+        tombstone_count = 0
+        try:
+            with open(self.file_name, 'rb') as file:
+                data = file.read()
+                data = data[:data.rfind(b'\n') + 1]  # Leaves a row still being written for the next read
+                self.remember_file(os.fstat(file.fileno()), len(data), data[-64:])
+            metrics.add('storage.read', bytes_read=len(data))
+            reader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+            next(reader)  # Skip header row
+            for row in reader:
+                if row and row[0] == self.TOMBSTONE:
+                    cancelled_at[row[1]] = len(rows)
+                    tombstone_count += 1
+                elif row:
+                    rows.append(row)
+            reservations = [Reservation.from_row(row) for position, row in enumerate(rows)
+                            if position >= cancelled_at.get(row[0], -1)]
+            metrics.add('storage.read', rows=len(rows) + tombstone_count)
+            return reservations, tombstone_count
         except FileNotFoundError as e:
             raise FileNotFoundError(f"Error: File '{self.file_name}' not found.") from e
         except Exception as e:
             raise Exception(f"An error occurred while reading the file '{self.file_name}': {e}") from e
 
-    # Writes new reservations and cancels existing ones
-    def write_reservation_data(self, reservations):
+    # Returns the changes other processes have appended since the file was last read, as a list of
+    # ('added', Reservation) and ('removed', reference_number) tuples in the order they were made. Returns None if
+    # the file has been replaced (for example compacted by another process) and has to be loaded again.
+    def read_changes(self):
         try:
-            with open(self.file_name, 'a', newline='') as file:
-                existing_reservations = set()  # Stores existing reservations to filter duplicates
-                # Reads existing reservations from the file
-                with open(self.file_name, 'r', newline='') as read_file:
-                    reader = csv.reader(read_file)
-                    next(reader)  # Skip header row
-                    for row in reader:
-                        existing_reservations.add(tuple(row[
-                                                        :5]))
-                        # Includes only reference number, customer name, room type, check-in date, and check-out date
-
-                # Writes only unique reservations to the file
-                writer = csv.writer(file)
-                for reservation in reservations:
-                    if tuple(reservation[:5]) not in existing_reservations:
-                        writer.writerow(reservation)
-                        existing_reservations.add(
-                            tuple(reservation[:5]))  # Add the new reservation to existing reservations
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            return [] if self.file_stat is None else None
+        if self.file_stat == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return []
+        if self.file_stat is None or stat.st_ino != self.file_stat[0] or stat.st_size < self.offset:
+            return None
+
+        with open(self.file_name, 'rb') as file:
+            file.seek(self.offset - len(self.tail))
+            data = file.read()
+        if not data.startswith(self.tail):
+            return None
+        data = data[len(self.tail):data.rfind(b'\n') + 1]  # Leaves a row still being written for the next read
+        self.remember_file(stat, self.offset + len(data), (self.tail + data)[-64:])
+
+        changes = []
+        for row in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+            if row and row[0] == self.TOMBSTONE:
+                self.tombstone_count += 1
+                changes.append(('removed', row[1]))
+            elif row:
+                changes.append(('added', Reservation.from_row(row)))
+        metrics.add('storage.read', rows=len(changes), bytes_read=len(self.tail) + len(data))
+        return changes
+
+    # Records how far the file has been read and what it looked like at that point
+    def remember_file(self, stat, offset, tail):
+        self.file_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.offset = offset
+        self.tail = tail
+
+    # Appends rows to the reservations file with a single buffered write, starting the file with the header row if
+    # it doesn't exist yet. Callers hold the reservation lock, so nothing else has been appended since the last read
+    # and the read offset can move to the new end of the file.
+    def append_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not os.path.exists(self.file_name):
+            writer.writerow(self.HEADER)
+        writer.writerows(rows)
+        data = buffer.getvalue().encode('utf-8')
+        with open(self.file_name, 'ab') as file:
+            file.write(data)
+            file.flush()
+            if self.fsync_writes:
+                os.fsync(file.fileno())
+            stat = os.fstat(file.fileno())
+        self.remember_file(stat, stat.st_size, (self.tail + data)[-64:])
+        metrics.add('storage.write', rows=len(rows), bytes_written=len(data))
+
+    # Appends new reservations to the end of the file
+    def append(self, reservations):
+        self.append_rows([reservation.to_row() for reservation in reservations])
+
+    # Cancels a reservation by appending a tombstone row, compacting the file once enough tombstones have built up
+    def remove(self, reference_number):
+        self.append_rows([[self.TOMBSTONE, reference_number]])
+        self.tombstone_count += 1
+        if self.tombstone_count >= self.compact_threshold:
+            self.compact()
+
+    # Rewrites the reservations file with only the live reservations. The new file is written and flushed to a
+    # temporary file next to the original and then renamed over it, so a crash part way through leaves the old file
+    # untouched instead of a truncated one.
+    @metrics.instrumented('storage.compact')
+    def compact(self):
+        reservations = self.read_reservation_log()[0]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.HEADER)
+        writer.writerows(reservation.to_row() for reservation in reservations)
+        data = buffer.getvalue().encode('utf-8')
+
+        directory = os.path.dirname(os.path.abspath(self.file_name))
+        temp_name = None
+        try:
+            with tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.tmp', delete=False) as file:
+                temp_name = file.name
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                stat = os.fstat(file.fileno())
+            os.chmod(temp_name, os.stat(self.file_name).st_mode)  # Keeps the permissions of the original file
+            os.replace(temp_name, self.file_name)
         except Exception as e:
-            raise Exception(f"An error occurred while saving reservation data: {e}") from e
+            if temp_name and os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise Exception(f"An error occurred while compacting the file '{self.file_name}': {e}") from e
+        self.remember_file(os.stat(self.file_name), stat.st_size, data[-64:])
+        metrics.add('storage.compact', rows=len(reservations), bytes_written=len(data))
+        self.tombstone_count = 0
+        self.write_snapshot(reservations)
 
-    # Removes a reservation based on the provides reference number
-    def cancel_reservation(self, reference_number):
-        reservations = self.read_reservation_data()
-        updated_reservations = []
-        found = False
-        for reservation in reservations:
-            if reservation[0] == reference_number:
-                found = True
+
+# Manages hotel reservations
+class ReservationManager:
+    # The reservations are only read from storage once here, so writing new ones never has to re-read them. The
+    # storage backend is picked from the file name (see create_reservation_storage) unless one is passed in;
+    # fsync_writes and compact_threshold are passed on to the CSV backend.
+    # Other processes (for example the console and the GUI running side by side) can change the same file, so every
+    # change is made while holding 'lock' exclusively, after picking up what the other processes have done with
+    # refresh(). Reading only takes 'read_lock': just the thread lock for storages that can be read while another
+    # process writes (LOCK_FREE_READS), otherwise the lock shared with other readers.
+    # Every reservation written or cancelled here is published on 'change_feed' and, unless change_log is False,
+    # logged to the change log next to the reservations (see change_feed.py).
+    def __init__(self, file_name, fsync_writes=False, compact_threshold=100, storage=None, change_log=True):
+        self.file_name = file_name
+        self.storage = storage or create_reservation_storage(file_name, fsync_writes, compact_threshold)
+        self.change_feed = ChangeFeed(file_name + '.changes' if change_log else None, fsync_writes)
+        self.lock = FileLock(file_name)
+        self.read_lock = self.lock.local if getattr(self.storage, 'LOCK_FREE_READS', False) else self.lock.shared
+        self.listeners = []  # Objects told about every reservation written or cancelled, e.g. availability indexes
+        self.reservations = {}  # Reference number -> Reservation, so lookups never have to scan the file
+        self.reservation_keys = set()  # Keys used to filter duplicates when writing
+        with self.read_lock:
+            self.load_reservations()
+
+    # Loads the live reservations into the reference number index and builds the set of keys used to filter
+    # duplicates: reference number, customer name, room type, check-in date, and check-out date.
+    # Loading creates several objects per reservation, none of which can form reference cycles, so the garbage
+    # collector is paused meanwhile instead of repeatedly scanning the growing heap for cycles.
+    @metrics.instrumented('load_reservations')
+    def load_reservations(self):
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            reservations = self.storage.load()
+            self.reservations = {reservation.reference_number: reservation for reservation in reservations}
+            self.reservation_keys = set(map(Reservation.key, reservations))
+            metrics.add('load_reservations', rows=len(reservations))
+        finally:
+            if collecting:
+                gc.enable()
+
+    # Picks up reservations made or cancelled by other processes since the last refresh and passes them on to the
+    # listeners. Usually only the end of the file is read; if the storage was replaced it is loaded again and
+    # compared with what is in memory.
+    @metrics.instrumented('refresh')
+    def refresh(self):
+        with self.read_lock:
+            changes = self.storage.read_changes()
+            if changes is None:
+                stored = {reservation.reference_number: reservation for reservation in self.storage.load()}
+                changes = [('removed', reference_number) for reference_number in self.reservations
+                           if reference_number not in stored]
+                changes += [('added', reservation) for reference_number, reservation in stored.items()
+                            if reference_number not in self.reservations]
+            for change, value in changes:
+                if change == 'added':
+                    self.remember(value)
+                else:
+                    self.forget(value)
+            metrics.add('refresh', rows=len(changes))
+
+    # Adds a reservation to the in-memory state and tells the listeners about it
+    def remember(self, reservation):
+        self.reservations[reservation.reference_number] = reservation
+        self.reservation_keys.add(reservation.key())
+        for listener in self.listeners:
+            listener.reservation_added(reservation)
+
+    # Removes a reservation from the in-memory state and tells the listeners about it
+    def forget(self, reference_number):
+        reservation = self.reservations.pop(reference_number, None)
+        if reservation is None:
+            return
+        self.reservation_keys.discard(reservation.key())
+        for listener in self.listeners:
+            listener.reservation_removed(reservation)
+
+    # Returns the reservation with the given reference number, or None if there isn't one
+    def get(self, reference_number):
+        self.refresh()
+        return self.reservations.get(reference_number)
+
+    # Registers a listener that gets 'reservation_added' and 'reservation_removed' calls with the Reservation whenever
+    # the data changes
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # Returns the current reservations as Reservation records, leaving out reservations that have been cancelled
+    @metrics.instrumented('read_reservation_data')
+    def read_reservation_data(self):
+        self.refresh()
+        metrics.add('read_reservation_data', rows=len(self.reservations))
+        return list(self.reservations.values())
+
+    # Saves new reservations. Duplicates are filtered with the in-memory key set and all new reservations are
+    # handed to storage in one go, so the cost of a booking doesn't depend on how many reservations already exist.
+    # Only a failure to save raises an error; once the reservations are stored they are kept in memory and published
+    # on the change feed, which never fails a booking that has been saved.
+    @metrics.instrumented('write_reservation_data')
+    def write_reservation_data(self, reservations):
+        with self.lock:
+            try:
+                self.refresh()
+                new_reservations = []
+                new_keys = set()
+                for reservation in reservations:
+                    key = reservation.key()
+                    if key not in self.reservation_keys and key not in new_keys:
+                        new_reservations.append(reservation)
+                        new_keys.add(key)
+                if not new_reservations:
+                    return
+                self.storage.append(new_reservations)
+            except Exception as e:
+                raise Exception(f"An error occurred while saving reservation data: {e}") from e
+
+            for reservation in new_reservations:
+                self.remember(reservation)
+            self.change_feed.publish([('created', reservation.to_dict()) for reservation in new_reservations])
+            metrics.add('write_reservation_data', rows=len(new_reservations))
+
+    # Generates the reservations as lines of text, one at a time, so large exports never have to be built in memory.
+    # Only stays that overlap [start_date, end_date) are exported; either date can be left out. The format is 'csv'
+    # (with the same header row as the reservations file) or 'json' for one JSON object per line.
+    def export_reservations(self, start_date=None, end_date=None, file_format='csv'):
+        if file_format not in ('csv', 'json'):
+            raise ValueError(f"Unknown export format '{file_format}'. Please use 'csv' or 'json'.")
+        start = to_date(start_date) if start_date is not None else None
+        end = to_date(end_date) if end_date is not None else None
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if file_format == 'csv':
+            writer.writerow(CsvReservationStorage.HEADER)
+            yield buffer.getvalue()
+        for reservation in self.read_reservation_data():
+            if ((start is not None and reservation.check_out <= start)
+                    or (end is not None and reservation.check_in >= end)):
+                continue
+            if file_format == 'json':
+                yield json.dumps(reservation.to_dict()) + '\n'
             else:
-                updated_reservations.append(reservation)
-        if found:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerow(reservation.to_row())
+                yield buffer.getvalue()
+
+    # Cancels a reservation based on the provided reference number
+    @metrics.instrumented('cancel_reservation')
+    def cancel_reservation(self, reference_number):
+        with self.lock:
+            self.refresh()
+            reservation = self.reservations.get(reference_number)
+            if reservation is None:
+                raise ValueError("Reservation not found.")
             try:
-                with open(self.file_name, 'w', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(
-                        ['Reference Number', 'Customer Name', 'Room Type', 'Check In', 'Check Out', 'Total Price'])
-                    writer.writerows(updated_reservations)
-                return True
+                self.storage.remove(reference_number)
             except Exception as e:
                 raise ValueError(f"An error occurred while canceling reservation {reference_number}: {e}")
-        else:
-            raise ValueError("Reservation not found.")
+            self.forget(reference_number)
+            self.change_feed.publish([('cancelled', reservation.to_dict())])
+        return True
+
+    # Compacts the underlying storage on demand, e.g. to drop the tombstones from a CSV file
+    def compact(self):
+        with self.lock:
+            self.refresh()
+            self.storage.compact()
+
 
 # This class is for validating different aspects of user input
 class Validator:
+    MAX_GROUP_SIZE = 200
+    MAX_STAY_NIGHTS = 365
+
     # Validates that number of people are within 1 to 4
     def validate_num_people(self, num_people):
         try:
@@ -154,31 +1141,44 @@ class Validator:
         if not 1 <= num_people <= 4:
             raise ValueError("Number of people must be between 1 and 4.")
 
-    # Validates that dates are in the correct chosen format which I have chosen is DD/MM/YYYY for this program
+    # Validates that dates are in the correct chosen format which I have chosen is DD/MM/YYYY for this program.
+    # Returns the parsed date so callers don't have to parse the string again.
     def validate_date_format(self, date_str):
         try:
-            datetime.strptime(date_str, '%d/%m/%Y').date()
-        except ValueError:
+            return parse_date(date_str)
+        except (ValueError, AttributeError):
             raise ValueError("Invalid date format. Please use the format dd/mm/yyyy.")
 
-    # Validates that check out date is after the check in date
-    def validate_date_range(self, check_in_date, check_out_date):
-        self.validate_date_format(check_in_date)
-        self.validate_date_format(check_out_date)
-
-        check_in = datetime.strptime(check_in_date, '%d/%m/%Y').date()
-        check_out = datetime.strptime(check_out_date, '%d/%m/%Y').date()
+    # Validates that check out date is after the check in date and returns both parsed dates. Stays can be at most
+    # max_nights long; ranges that aren't stays, such as the period of a report, pass max_nights=None.
+    def validate_date_range(self, check_in_date, check_out_date, max_nights=MAX_STAY_NIGHTS):
+        check_in = self.validate_date_format(check_in_date)
+        check_out = self.validate_date_format(check_out_date)
 
         if check_out <= check_in:
             raise ValueError("Check-out date must be after the check-in date.")
+        if max_nights is not None and (check_out - check_in).days > max_nights:
+            raise ValueError(f"A stay can be at most {max_nights} nights long.")
+        return check_in, check_out
 
-    # This ensures that the provided check in date is not in the past
+    # This ensures that the provided check in date is not in the past and returns the parsed date
     def validate_check_in(self, check_in_date):
-        self.validate_date_format(check_in_date)
+        check_in = self.validate_date_format(check_in_date)
 
         today = datetime.now().date()
-        if datetime.strptime(check_in_date, '%d/%m/%Y').date() < today:
+        if check_in < today:
             raise ValueError("Check-in date cannot be in the past.")
+        return check_in
+
+    # Validates the size of a group booking, which is spread over as many rooms as it needs
+    def validate_group_size(self, num_people):
+        try:
+            num_people = int(num_people)
+        except ValueError:
+            raise ValueError("Invalid input. Please enter a valid number.")
+
+        if not 1 <= num_people <= self.MAX_GROUP_SIZE:
+            raise ValueError(f"Number of people in a group must be between 1 and {self.MAX_GROUP_SIZE}.")
 
     # This method validates that the customer's name is not empty
     def validate_name_filled(self, name):
@@ -187,6 +1187,12 @@ class Validator:
 
 # This class is for managing hotel operations
 class HotelManager:
+    # Reference numbers use 32 uppercase letters and digits, leaving out 0, O, 1 and I which are easy to confuse when
+    # read out over the phone. With 32 symbols every random byte maps to exactly one character without bias.
+    REFERENCE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+    REFERENCE_LENGTH = 8
+    REFERENCE_TABLE = (REFERENCE_ALPHABET * 8).encode('ascii')  # Maps byte value b to REFERENCE_ALPHABET[b % 32]
+
     # Initialises a 'HotelManager' object with instances of 'RoomManager;, 'ReservationManager', and 'Validator'
     def __init__(self, room_manager, reservation_manager, validator):
         self.room_manager = room_manager
@@ -197,45 +1203,167 @@ class HotelManager:
     # using the 'Validator' instance. Wraps the reservation process in a try-except block to handle any exceptions
     # that might occur during the reservation process. If an exception occurs, it raises the exception to be
     # handled at a higher level
+    @metrics.instrumented('make_reservation')
     def make_reservation(self, customer_name, num_people, check_in_date, check_out_date, selected_room):
         try:
-            # Validates input data
+            # Validates input data, keeping the parsed dates for the rest of the reservation
             self.validator.validate_num_people(num_people)
-            self.validator.validate_date_format(check_in_date)
-            self.validator.validate_date_format(check_out_date)
-            self.validator.validate_date_range(check_in_date, check_out_date)
+            check_in, check_out = self.validator.validate_date_range(check_in_date, check_out_date)
             self.validator.validate_check_in(check_in_date)
             self.validator.validate_name_filled(customer_name)
 
-            # Generates a unique reference number for the reservation
-            reference_number = self.generate_reference()
+            # Checks availability and writes the reservation while holding the reservation lock, so another terminal
+            # can't book the same room for overlapping dates in between. allocate_room picks up bookings made
+            # elsewhere before it checks the room. How long the lock is held is measured on its own, as it holds up
+            # every other booking.
+            with self.reservation_manager.lock, metrics.measure('make_reservation.locked'):
+                # Assigns a room of the selected type that is still free, preferring the room shown in the search
+                # results
+                room = self.room_manager.allocate_room(selected_room['room_type'], check_in, check_out, num_people,
+                                                       self.reservation_manager, selected_room.get('room_id'))
 
-            # Calculates total price based on selected room and reservation dates
-            total_price = float(self.calculate_total_price(selected_room['price_per_night'], check_in_date,
-                                                           check_out_date))
+                # Generates a unique reference number for the reservation
+                reference_number = self.generate_reference()
 
-            # Writes reservation data
-            reservation_data = [reference_number, customer_name, selected_room['room_type'], check_in_date,
-                                check_out_date, total_price]
-            self.reservation_manager.write_reservation_data([reservation_data])
+                # Calculates total price based on the allocated room, its rate plans and reservation dates
+                total_price = self.calculate_total_price(
+                    room['price_per_night'], check_in, check_out, room['room_type'],
+                    self.room_manager.stay_occupancy(room['room_type'], check_in, check_out, self.reservation_manager))
+
+                # Writes reservation data
+                reservation = Reservation(reference_number, customer_name, room['room_type'], check_in, check_out,
+                                          total_price, room['room_id'])
+                self.reservation_manager.write_reservation_data([reservation])
 
             return reference_number, total_price
         except Exception as e:
             raise e
 
+    # Makes many reservations at once, e.g. for a group or a feed from a channel manager. Each booking is a dictionary
+    # with 'customer_name', 'num_people', 'check_in', 'check_out' and 'room_type', and optionally 'room_id'. The
+    # bookings can come from a generator and are read one at a time. They are all validated and given rooms while
+    # holding the reservation lock, then written to storage together in a single append, so a batch costs one write
+    # however many bookings it has. A booking that fails doesn't stop the rest of the batch.
+    # Returns a list of (row number, reference number, total price) for the bookings made and a list of
+    # (row number, error message) for the bookings that failed, where the first booking is row 1.
+    @metrics.instrumented('make_reservations')
+    def make_reservations(self, bookings):
+        made = []
+        failed = []
+        reservations = []
+        references = []
+        batch_references = set()
+        with self.reservation_manager.lock, metrics.measure('make_reservations.locked'):
+            availability_index = self.room_manager.get_availability_index(self.reservation_manager)
+            try:
+                for row_number, booking in enumerate(bookings, start=1):
+                    try:
+                        customer_name = booking['customer_name']
+                        num_people = booking['num_people']
+                        self.validator.validate_num_people(num_people)
+                        check_in, check_out = self.validator.validate_date_range(booking['check_in'],
+                                                                                 booking['check_out'])
+                        self.validator.validate_check_in(booking['check_in'])
+                        self.validator.validate_name_filled(customer_name)
+                        room_id = booking.get('room_id')
+                        room = self.room_manager.allocate_room(booking['room_type'], check_in, check_out, num_people,
+                                                               self.reservation_manager,
+                                                               int(room_id) if room_id not in (None, '') else None)
+                    except KeyError as e:
+                        failed.append((row_number, f"Missing field {e}."))
+                        continue
+                    except (ValueError, TypeError, AttributeError) as e:
+                        failed.append((row_number, str(e)))
+                        continue
+
+                    # References are generated in blocks; the batch's own references aren't saved yet, so they are
+                    # also checked against each other
+                    while True:
+                        if not references:
+                            references = self.generate_references(256)
+                        reference_number = references.pop()
+                        if reference_number not in batch_references:
+                            break
+                    batch_references.add(reference_number)
+
+                    total_price = self.calculate_total_price(
+                        room['price_per_night'], check_in, check_out, room['room_type'],
+                        self.room_manager.stay_occupancy(room['room_type'], check_in, check_out,
+                                                         self.reservation_manager))
+                    reservations.append(Reservation(reference_number, customer_name, room['room_type'], check_in,
+                                                    check_out, total_price, room['room_id']))
+                    made.append((row_number, reference_number, total_price))
+                    # Books the nights in the availability index straight away so later bookings in the batch can't
+                    # be given the same room. Writing the reservations adds them to the index again, which changes
+                    # nothing.
+                    availability_index.add(room['room_id'], reference_number, check_in.toordinal(),
+                                           check_out.toordinal())
+
+                self.reservation_manager.write_reservation_data(reservations)
+            except Exception:
+                # Frees the rooms held for the bookings of the batch that weren't saved. Reservations that reached
+                # storage are in the reservation manager, and their rooms stay booked.
+                for reservation in reservations:
+                    if reservation.reference_number not in self.reservation_manager.reservations:
+                        availability_index.remove(reservation.reference_number)
+                raise
+        metrics.add('make_reservations', rows=len(made) + len(failed))
+        return made, failed
+
+    # Books a group too large for one room into the cheapest set of free rooms that holds it (see
+    # RoomManager.plan_group_rooms), one reservation per room under the customer's name. The rooms are chosen and
+    # all the reservations written in a single append while holding the reservation lock, so either the whole group
+    # is booked or none of it is. Returns the rooms with the reference_number of each reservation added.
+    @metrics.instrumented('make_group_reservation')
+    def make_group_reservation(self, customer_name, num_people, check_in_date, check_out_date):
+        self.validator.validate_group_size(num_people)
+        check_in, check_out = self.validator.validate_date_range(check_in_date, check_out_date)
+        self.validator.validate_check_in(check_in_date)
+        self.validator.validate_name_filled(customer_name)
+
+        with self.reservation_manager.lock, metrics.measure('make_group_reservation.locked'):
+            rooms = self.room_manager.plan_group_rooms(check_in, check_out, num_people, self.reservation_manager)
+            if rooms is None:
+                raise ValueError(f"There aren't enough free rooms for a group of {num_people} on these dates.")
+            for room, reference_number in zip(rooms, self.generate_references(len(rooms))):
+                room['reference_number'] = reference_number
+            self.reservation_manager.write_reservation_data(
+                [Reservation(room['reference_number'], customer_name, room['room_type'], check_in, check_out,
+                             room['total_price'], room['room_id']) for room in rooms])
+        return rooms
+
     # This method generates a unique reference number for each reservation using a combination of uppercase letters
     # and digits
     def generate_reference(self):
-        characters = string.ascii_uppercase + string.digits
-        return ''.join(random.choice(characters) for _ in range(8))
+        return self.generate_references(1)[0]
+
+    # Generates the given number of reference numbers at once, e.g. for batch imports. Random bytes from 'secrets'
+    # are turned into characters with a single translate call, and every reference is checked against the
+    # reservation manager's reference index and the rest of the batch, so no two reservations can share one.
+    def generate_references(self, count):
+        self.reservation_manager.refresh()
+        existing = self.reservation_manager.reservations
+        references = []
+        batch = set()
+        while len(references) < count:
+            needed = count - len(references)
+            characters = secrets.token_bytes(needed * self.REFERENCE_LENGTH).translate(self.REFERENCE_TABLE).decode()
+            for start in range(0, len(characters), self.REFERENCE_LENGTH):
+                reference = characters[start:start + self.REFERENCE_LENGTH]
+                if reference not in batch and reference not in existing:
+                    batch.add(reference)
+                    references.append(reference)
+        return references
 
     # This method is to calculate the total price for a reservation based on the selected room's price per night
-    # and the duration of stay
-    def calculate_total_price(self, price_per_night, check_in_date, check_out_date):
-        check_in = datetime.strptime(check_in_date, '%d/%m/%Y').date()
-        check_out = datetime.strptime(check_out_date, '%d/%m/%Y').date()
-        num_nights = (check_out - check_in).days
-        total_price = num_nights * price_per_night
+    # and the duration of stay, adjusted by the rate plans for the room type (only the rules for every room type
+    # apply if none is given) and the fraction of its rooms already taken. The dates can be DD/MM/YYYY strings or
+    # already parsed dates.
+    def calculate_total_price(self, price_per_night, check_in_date, check_out_date, room_type=None, occupancy=0.0):
+        check_in = to_date(check_in_date).toordinal()
+        check_out = to_date(check_out_date).toordinal()
+        total_price = self.room_manager.pricing_engine.quote(room_type, price_per_night, check_in, check_out,
+                                                             occupancy)
         return float(total_price)
 
     # Cancels a reservation according to the given reference number
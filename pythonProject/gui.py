@@ -1,13 +1,21 @@
 # This file is for the code for GUI application for my hotel booking system implemented using the Tkinter library
 # It imports classes from common_functionalities to create the application
+# Usage: python gui.py [property ID from properties.csv]
+import sys
 import tkinter as tk
-from tkinter import messagebox, simpledialog, ttk
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import filedialog, messagebox, simpledialog, ttk
 from datetime import datetime
 from common_functionalities import HotelManager, RoomManager, ReservationManager, Validator
+from metrics import metrics
+from properties import PropertyManager
 
 class HotelManagementApp:
-    def __init__(self, master):
-        # Initialises the GUI window (master)
+    # How often (in milliseconds) the Tk thread checks whether work running in the background has finished
+    POLL_INTERVAL = 50
+
+    def __init__(self, master, room_file_name="hotel_room.csv", reservation_file_name="reservations.csv"):
+        # Initialises the GUI window (master) for the hotel with the given room and reservations files
         self.master = master
         master.title("Hotel Management System")
 
@@ -15,13 +23,20 @@ class HotelManagementApp:
         self.logo_image = tk.PhotoImage(file="logo.png")  # Replace "logo.png" with the path to your logo image
 
         # Initialises RoomManager, ReservationManager, and Validator
-        self.room_manager = RoomManager("hotel_room.csv", Validator())
-        self.reservation_manager = ReservationManager("reservations.csv")
+        self.room_manager = RoomManager(room_file_name, Validator())
+        self.reservation_manager = ReservationManager(reservation_file_name)
         self.validator = Validator()
 
         # Initialises HotelManager with RoomManager, ReservationManager, and Validator
         self.hotel_manager = HotelManager(self.room_manager, self.reservation_manager, self.validator)
 
+        # Searches, bookings and cancellations read and write the reservations file, so they run on a worker thread
+        # to keep the window responsive. Only this one thread ever uses the managers.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.busy_count = 0  # Number of background tasks that haven't finished yet
+        self.search_generation = 0  # Increased whenever the search inputs change, so stale results can be ignored
+        self.pending_search = None
+
         # Creates labels and entry widgets for reservation details
         tk.Label(master, image=self.logo_image).grid(row=0, columnspan=2)  # Display the logo
 
@@ -67,6 +82,69 @@ class HotelManagementApp:
         self.quit_button = tk.Button(master, text="Quit", command=master.quit)
         self.quit_button.grid(row=9, columnspan=2)
 
+        # Label showing when work is running in the background
+        self.status_label = tk.Label(master, text="")
+        self.status_label.grid(row=10, columnspan=2)
+
+        # Button to save the performance metrics, shown when the GUI was started with HOTEL_METRICS=1
+        if metrics.enabled:
+            self.export_metrics_button = tk.Button(master, text="Export Metrics", command=self.export_metrics)
+            self.export_metrics_button.grid(row=11, columnspan=2)
+
+        # Changing the dates or the number of people makes any search that is still running stale
+        for entry in (self.check_in_entry, self.check_out_entry, self.num_people_entry):
+            entry.bind("<KeyRelease>", self.cancel_stale_search)
+
+    def run_in_background(self, task, on_success, on_error, *arguments):
+        # Method to run a task on the worker thread. Tkinter widgets may only be used from the Tk thread, so instead of
+        # the worker calling back, the Tk thread polls the task with after() and then calls on_success with the
+        # result or on_error with the exception.
+        future = self.executor.submit(task, *arguments)
+        self.set_busy(1)
+        self.master.after(self.POLL_INTERVAL, self.check_background_task, future, on_success, on_error)
+        return future
+
+    def check_background_task(self, future, on_success, on_error):
+        # Method to check whether a background task has finished and pass its result on
+        if not future.done():
+            self.master.after(self.POLL_INTERVAL, self.check_background_task, future, on_success, on_error)
+            return
+        self.set_busy(-1)
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            on_error(exception)
+        else:
+            on_success(future.result())
+
+    def set_busy(self, change):
+        # Method to show a busy cursor and message while any background task is running
+        self.busy_count += change
+        busy = self.busy_count > 0
+        self.master.config(cursor="watch" if busy else "")
+        self.status_label.config(text="Working, please wait..." if busy else "")
+
+    def cancel_stale_search(self, event=None):
+        # Method to drop the search that is running, because the dates or number of people it was for have changed
+        self.search_generation += 1
+        if self.pending_search is not None:
+            self.pending_search.cancel()  # Only stops the search if it hasn't started yet; otherwise it is ignored
+            self.pending_search = None
+
+    def export_metrics(self):
+        # Method to save the performance metrics recorded so far, as JSON if the file name ends in .json and as
+        # Prometheus-style text otherwise
+        file_name = filedialog.asksaveasfilename(title="Export Metrics", defaultextension=".prom",
+                                                 filetypes=[("Prometheus text", "*.prom"), ("JSON", "*.json")])
+        if not file_name:
+            return
+        try:
+            metrics.write(file_name)
+            messagebox.showinfo("Export Metrics", f"Metrics saved to {file_name}.")
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
     def get_default_date(self):
         # Method to get the current date in the format "DD/MM/YYYY"
         return datetime.now().strftime("%d/%m/%Y")
@@ -101,21 +179,15 @@ class HotelManagementApp:
             self.validator.validate_date_range(check_in_date, check_out_date)
             self.validator.validate_check_in(check_in_date)
 
-            # Filters available rooms based on inputs using RoomManager
-            available_rooms = self.room_manager.filter_room_options(check_in_date, check_out_date, num_people,
-                                                                    self.reservation_manager)
-
-            if not available_rooms:
-                # If no available rooms, shows info message
-                messagebox.showinfo("No Rooms Available", "There are no rooms available for the "
-                                                          "selected dates and number of people.")
-            else:
-                # Displays available rooms in the listbox
-                self.room_listbox.delete(0, tk.END)
-                for room in available_rooms:
-                    self.room_listbox.insert(tk.END, f"{room['room_type']}"
-                                                     f" - Price: ${room['price_per_night']:.2f}")
-                messagebox.showinfo("Available Rooms", "Available rooms have been loaded.")
+            # Filters available rooms based on inputs using RoomManager on the worker thread. A newer search replaces
+            # one that is still running.
+            self.cancel_stale_search()
+            generation = self.search_generation
+            self.pending_search = self.run_in_background(
+                self.room_manager.filter_room_options,
+                lambda available_rooms: self.show_available_rooms(generation, available_rooms),
+                lambda e: self.show_search_error(generation, e),
+                check_in_date, check_out_date, num_people, self.reservation_manager)
         except ValueError as ve:
             # Handles validation errors
             messagebox.showerror("Value Error", str(ve))
@@ -123,6 +195,34 @@ class HotelManagementApp:
             # Handles other exceptions
             messagebox.showerror("Error", str(e))
 
+    def show_available_rooms(self, generation, available_rooms):
+        # Method to show the results of a search, unless the inputs have changed since it was started
+        if generation != self.search_generation:
+            return
+        self.pending_search = None
+        if not available_rooms:
+            # If no available rooms, shows info message
+            messagebox.showinfo("No Rooms Available", "There are no rooms available for the "
+                                                      "selected dates and number of people.")
+        else:
+            # Displays available rooms in the listbox
+            self.room_listbox.delete(0, tk.END)
+            for room in available_rooms:
+                self.room_listbox.insert(tk.END, f"{room['room_type']}"
+                                                 f" - Price: ${room['price_per_night']:.2f}"
+                                                 f" - Total: ${room['total_price']:.2f}")
+            messagebox.showinfo("Available Rooms", "Available rooms have been loaded.")
+
+    def show_search_error(self, generation, error):
+        # Method to show why a search failed, unless the inputs have changed since it was started
+        if generation != self.search_generation:
+            return
+        self.pending_search = None
+        if isinstance(error, ValueError):
+            messagebox.showerror("Value Error", str(error))
+        else:
+            messagebox.showerror("Error", str(error))
+
     def generate_receipt_message(self, reference_number, customer_name, room_type, check_in_date,
                                  check_out_date, total_price):
         # method to generate receipt message
@@ -152,9 +252,10 @@ class HotelManagementApp:
             # If a room is selected
             selected_room_index = selected_index[0]
             selected_room_info = self.room_listbox.get(selected_room_index)
-            # Then this extracts room type and price from the selected room information
-            selected_room_type, price_info = selected_room_info.split(' - ')
+            # Then this extracts room type, price and total price of the stay from the selected room information
+            selected_room_type, price_info, total_info = selected_room_info.split(' - ')
             price_per_night = float(price_info.split(': $')[1])
+            total_price = float(total_info.split(': $')[1])
 
             try:
                 # Validates that the number of people is an integer
@@ -172,33 +273,26 @@ class HotelManagementApp:
                 confirmation = messagebox.askyesno("Confirm Booking",
                                                    f"Do you want to book {selected_room_type}"
                                                    f" room?\nPrice per night: ${price_per_night:.2f}"
+                                                   f"\nTotal for the stay: ${total_price:.2f}"
                                                    f"\n\nRefund Policy:\nYou are eligible for a 70% refund if "
                                                    f"you cancel the reservation before the check-in date.")
 
                 if confirmation:
-                    # If user confirms booking, this makes a reservation
-                    reference_number, total_price = self.hotel_manager.make_reservation(
+                    # If user confirms booking, this makes a reservation on the worker thread
+                    check_in_date = self.check_in_entry.get()
+                    check_out_date = self.check_out_entry.get()
+                    self.run_in_background(
+                        self.hotel_manager.make_reservation,
+                        lambda result: self.show_booking_confirmation(result, customer_name, selected_room_type,
+                                                                      check_in_date, check_out_date),
+                        lambda e: messagebox.showerror("Booking Error", str(e)),
                         customer_name,
                         num_people,  # Uses the validated number of people
-                        self.check_in_entry.get(),
-                        self.check_out_entry.get(),
+                        check_in_date,
+                        check_out_date,
                         {'room_type': selected_room_type, 'price_per_night': price_per_night}
                     )
 
-                    # Generates receipt message
-                    receipt_text = self.generate_receipt_message(
-                        reference_number,
-                        customer_name,
-                        selected_room_type,
-                        self.check_in_entry.get(),
-                        self.check_out_entry.get(),
-                        total_price
-                    )
-
-                    # Displays reservation confirmation message
-                    messagebox.showinfo("Reservation Confirmation", f"{receipt_text}\n\nThank you for "
-                                                                    f"choosing our hotel!")
-
             except ValueError as ve:
                 # Handles invalid name error
                 messagebox.showerror("Invalid Name", str(ve))
@@ -208,6 +302,24 @@ class HotelManagementApp:
             # If no room is selected, shows a warning message
             messagebox.showwarning("Selection Required", "Please select a room to book.")
 
+    def show_booking_confirmation(self, result, customer_name, room_type, check_in_date, check_out_date):
+        # Method to show the receipt once a reservation has been made
+        reference_number, total_price = result
+
+        # Generates receipt message
+        receipt_text = self.generate_receipt_message(
+            reference_number,
+            customer_name,
+            room_type,
+            check_in_date,
+            check_out_date,
+            total_price
+        )
+
+        # Displays reservation confirmation message
+        messagebox.showinfo("Reservation Confirmation", f"{receipt_text}\n\nThank you for "
+                                                        f"choosing our hotel!")
+
     def cancel_reservation(self):
         # Method to cancel a reservation
 
@@ -215,62 +327,76 @@ class HotelManagementApp:
         reference_number = simpledialog.askstring("Cancel Reservation",
                                                   "Enter the reference number of the reservation to cancel:")
         if reference_number:
-            try:
-                # Reads reservation data from the reservation manager
-                reservations = self.reservation_manager.read_reservation_data()
-                found_reservation = None
-
-                # Searches for the reservation with the given reference number
-                for reservation in reservations:
-                    if reservation[0] == reference_number:
-                        found_reservation = reservation
-                        break
-
-                # If the reservation is found
-                if found_reservation:
-                    (reference_number, customer_name, room_type, check_in_date,
-                     check_out_date, total_price) = found_reservation
-
-                    # Generates booking receipt message
-                    booking_receipt_message = self.generate_receipt_message(reference_number, customer_name, room_type,
-                                                                            check_in_date, check_out_date,
-                                                                              float(total_price))
-                    # Calculates refund amount
-                    refund_amount = self.hotel_manager.calculate_refund(float(total_price))
-
-                    # Asks for confirmation before cancellation
-                    confirmation = messagebox.askyesno("Confirm Cancellation",
-                                                       f"Are you sure you want to cancel the reservation "
-                                                       f"with reference number {reference_number}?\n\nBooking Receipt:\n"
-                                                       f"{booking_receipt_message}\n"
-                                                       f"Refund Policy:\n"
-                                                       f"You are eligible for a 70% refund if you cancel the"
-                                                       f" reservation before the check-in date. "
-                                                       f"Refund Amount: ${refund_amount:.2f}")
-
-                    if confirmation:
-                        # If user confirms cancellation, cancels the reservation
-                        if self.hotel_manager.cancel_reservation(reference_number):
-                            messagebox.showinfo("Cancellation Successful",
-                                                f"Reservation with reference number {reference_number} has "
-                                                f"been canceled. You have been refunded ${self.hotel_manager
-                                                .calculate_refund(float(total_price)):.2f}"
-                                                f"\n\nThank you for using our service!")
-                        else:
-                            # Shows error message if reservation not found
-                            messagebox.showerror("Cancellation Error",
-                                                 f"Reservation with reference number {reference_number} "
-                                                 f"not found.")
-                else:
-                    # If no reservation found with the given reference number
-                    messagebox.showerror("Reservation Not Found",
-                                         f"No reservation found with reference number {reference_number}.")
-            except Exception as e:
-                # Shows error message if an exception occurs during cancellation
-                messagebox.showerror("Cancellation Error", str(e))
+            # Looks up the reservation with the given reference number in the reservation manager on the worker thread
+            self.run_in_background(
+                self.reservation_manager.get,
+                lambda found_reservation: self.confirm_cancellation(reference_number, found_reservation),
+                lambda e: messagebox.showerror("Cancellation Error", str(e)),
+                reference_number)
+
+    def confirm_cancellation(self, reference_number, found_reservation):
+        # Method to show the reservation that was looked up and ask whether to cancel it
+
+        # If no reservation found with the given reference number
+        if not found_reservation:
+            messagebox.showerror("Reservation Not Found",
+                                 f"No reservation found with reference number {reference_number}.")
+            return
 
+        customer_name = found_reservation.customer_name
+        room_type = found_reservation.room_type
+        check_in_date = found_reservation.check_in_date
+        check_out_date = found_reservation.check_out_date
+        total_price = found_reservation.total_price
+
+        # Generates booking receipt message
+        booking_receipt_message = self.generate_receipt_message(reference_number, customer_name, room_type,
+                                                                check_in_date, check_out_date, total_price)
+        # Calculates refund amount
+        refund_amount = self.hotel_manager.calculate_refund(total_price)
+
+        # Asks for confirmation before cancellation
+        confirmation = messagebox.askyesno("Confirm Cancellation",
+                                           f"Are you sure you want to cancel the reservation "
+                                           f"with reference number {reference_number}?\n\nBooking Receipt:\n"
+                                           f"{booking_receipt_message}\n"
+                                           f"Refund Policy:\n"
+                                           f"You are eligible for a 70% refund if you cancel the"
+                                           f" reservation before the check-in date. "
+                                           f"Refund Amount: ${refund_amount:.2f}")
+
+        if confirmation:
+            # If user confirms cancellation, cancels the reservation on the worker thread
+            self.run_in_background(
+                self.hotel_manager.cancel_reservation,
+                lambda result: self.show_cancellation_result(reference_number, refund_amount, result),
+                lambda e: messagebox.showerror("Cancellation Error", str(e)),
+                reference_number)
+
+    def show_cancellation_result(self, reference_number, refund_amount, result):
+        # Method to tell the user whether the cancellation went through
+        if result:
+            messagebox.showinfo("Cancellation Successful",
+                                f"Reservation with reference number {reference_number} has "
+                                f"been canceled. You have been refunded ${refund_amount:.2f}"
+                                f"\n\nThank you for using our service!")
+        else:
+            # Shows error message if reservation not found
+            messagebox.showerror("Cancellation Error",
+                                 f"Reservation with reference number {reference_number} "
+                                 f"not found.")
 
 
 root = tk.Tk()
-app = HotelManagementApp(root)
+if len(sys.argv) > 1:
+    try:
+        selected_property = PropertyManager().properties[sys.argv[1]]
+    except KeyError:
+        root.withdraw()
+        messagebox.showerror("Error", f"Unknown property '{sys.argv[1]}'.")
+        root.destroy()
+        sys.exit(1)
+    app = HotelManagementApp(root, selected_property['room_file'], selected_property['reservation_file'])
+else:
+    app = HotelManagementApp(root)
 root.mainloop()
@@ -0,0 +1,118 @@
+# Load test for booking_service.py. Starts a local instance of the service on a copy of the data files, then opens
+# several keep-alive connections that send a mix of searches, lookups and bookings as fast as the service answers
+# them, and reports the requests per second and the latency percentiles.
+# Usage: python load_test.py [connections] [requests per connection]
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+
+# Returns a TCP port that nothing is listening on
+def find_free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+# Sends one request on an open connection and waits for the whole response. Returns the status code and JSON body.
+async def send_request(reader, writer, method, path, body=None):
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(payload)}\r\n\r\n"
+                 .encode('latin-1') + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            content_length = int(value)
+    return status, json.loads(await reader.readexactly(content_length))
+
+
+# Runs one client connection and records the latency of every request
+async def run_client(port, request_count, latencies, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    references = []
+    try:
+        for _ in range(request_count):
+            check_in = date.today() + timedelta(days=random.randint(1, 60))
+            check_out = check_in + timedelta(days=random.randint(1, 5))
+            dates = {'check_in': check_in.strftime('%d/%m/%Y'), 'check_out': check_out.strftime('%d/%m/%Y')}
+            choice = random.random()
+            start = time.perf_counter()
+            if choice < 0.05:
+                status, result = await send_request(reader, writer, 'POST', '/reservations',
+                                                    dict(dates, customer_name='Load Test', num_people=1,
+                                                         room_type=random.choice(['Standard-Double', 'Family'])))
+                if status == 201:
+                    references.append(result['reference_number'])
+            elif choice < 0.2 and references:
+                status, _ = await send_request(reader, writer, 'GET', f"/reservations/{random.choice(references)}")
+            else:
+                status, _ = await send_request(reader, writer, 'GET', f"/rooms?check_in={dates['check_in']}"
+                                                                      f"&check_out={dates['check_out']}&num_people=2")
+            latencies.append(time.perf_counter() - start)
+            if status >= 500:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+# Waits until the service accepts connections
+async def wait_for_service(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def run_load_test(connections, request_count, port):
+    await wait_for_service(port)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(port, request_count, latencies, errors) for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"{len(latencies):,} requests over {connections} connections in {elapsed:.2f}s: "
+          f"{len(latencies) / elapsed:,.0f} requests/s")
+    print(f"Latency p50 {percentile(0.50):.2f}ms, p90 {percentile(0.90):.2f}ms, p99 {percentile(0.99):.2f}ms, "
+          f"max {latencies[-1] * 1000:.2f}ms, {len(errors)} server errors")
+
+
+if __name__ == "__main__":
+    connection_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    requests_per_connection = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    directory = tempfile.mkdtemp()
+    for file_name in ("hotel_room.csv", "reservations.csv"):
+        shutil.copy(file_name, directory)
+    if os.path.exists("rate_plans.csv"):
+        shutil.copy("rate_plans.csv", directory)  # So the service prices rooms as the hotel does
+    service_port = find_free_port()
+    service = subprocess.Popen([sys.executable, os.path.abspath("booking_service.py"), str(service_port),
+                                "hotel_room.csv", "reservations.csv"], cwd=directory, stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(run_load_test(connection_count, requests_per_connection, service_port))
+    finally:
+        service.terminate()
+        service.wait()
+        shutil.rmtree(directory)
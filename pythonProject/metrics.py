@@ -0,0 +1,209 @@
+# Opt-in instrumentation for the hotel booking system. When it is switched on (by setting the HOTEL_METRICS
+# environment variable to 1 before starting the console, GUI or booking service, or by calling metrics.enable()),
+# every instrumented operation records:
+#   a latency histogram, its call count and the time spent in it
+#   the errors it raised, by the type of the original error (errors are often re-raised as a generic Exception, so
+#   the chain of causes is followed back to the first one)
+#   the rows it scanned, read or wrote and the bytes it read from and wrote to disk
+# The totals can be exported as Prometheus-style text or as JSON. When it is switched off an instrumented function
+# only checks one flag before calling through, and the counters return straight away.
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds (in seconds) of the buckets of the latency histograms. Times above the last one go in a final bucket.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+# The totals recorded for one operation
+class OperationStats:
+    __slots__ = ('calls', 'seconds', 'buckets', 'errors', 'rows', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # Number of calls per bucket, not cumulative
+        self.errors = {}  # Error type name -> number of calls that raised it
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], self.buckets)),
+            'errors': dict(self.errors),
+            'rows': self.rows,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written
+        }
+
+
+# Times one block of code as a context manager. Rows and bytes can be added to the operation from inside the block.
+class Measurement:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start, exc_value)
+        return False
+
+    def add(self, rows=0, bytes_read=0, bytes_written=0):
+        self.metrics.add(self.name, rows, bytes_read, bytes_written)
+
+
+# Stands in for a Measurement when the metrics are switched off, so measured blocks cost next to nothing
+class NoMeasurement:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, rows=0, bytes_read=0, bytes_written=0):
+        pass
+
+
+NO_MEASUREMENT = NoMeasurement()
+
+
+# Collects the totals of every operation. Operations can run on several threads (the GUI and the booking service
+# run them on worker threads), so the totals are only changed while holding a lock.
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.operations = {}  # Operation name -> OperationStats
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+    # Returns the totals of an operation, creating them the first time it is seen. Callers hold the lock.
+    def stats_for(self, name):
+        stats = self.operations.get(name)
+        if stats is None:
+            stats = self.operations[name] = OperationStats()
+        return stats
+
+    # Records one call of an operation that took the given number of seconds and raised the given error, if any
+    def record(self, name, seconds, error=None):
+        if error is not None:
+            while error.__cause__ is not None:
+                error = error.__cause__
+        with self.lock:
+            stats = self.stats_for(name)
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if error is not None:
+                error_type = type(error).__name__
+                stats.errors[error_type] = stats.errors.get(error_type, 0) + 1
+
+    # Adds rows scanned and bytes read or written to an operation
+    def add(self, name, rows=0, bytes_read=0, bytes_written=0):
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.stats_for(name)
+            stats.rows += rows
+            stats.bytes_read += bytes_read
+            stats.bytes_written += bytes_written
+
+    # Returns a context manager that times the block it wraps as one call of the operation
+    def measure(self, name):
+        return Measurement(self, name) if self.enabled else NO_MEASUREMENT
+
+    # Decorator that times every call of a function as one call of the operation
+    def instrumented(self, name):
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException as e:
+                    self.record(name, time.perf_counter() - start, e)
+                    raise
+                self.record(name, time.perf_counter() - start)
+                return result
+            return wrapper
+        return decorate
+
+    # Returns the totals of every operation as a dictionary that can be written as JSON
+    def to_dict(self):
+        with self.lock:
+            return {'enabled': self.enabled,
+                    'operations': {name: stats.to_dict() for name, stats in sorted(self.operations.items())}}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    # Returns the totals in the Prometheus text exposition format
+    def to_prometheus(self):
+        with self.lock:
+            operations = sorted(self.operations.items())
+            lines = ['# HELP hotel_operation_duration_seconds Time spent in each operation.',
+                     '# TYPE hotel_operation_duration_seconds histogram']
+            for name, stats in operations:
+                if not stats.calls:
+                    continue
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], stats.buckets):
+                    cumulative += count
+                    lines.append(f'hotel_operation_duration_seconds_bucket{{operation="{name}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'hotel_operation_duration_seconds_sum{{operation="{name}"}} {stats.seconds}')
+                lines.append(f'hotel_operation_duration_seconds_count{{operation="{name}"}} {stats.calls}')
+
+            lines += ['# HELP hotel_operation_errors_total Calls of each operation that raised an error, by the type '
+                      'of the original error.',
+                      '# TYPE hotel_operation_errors_total counter']
+            for name, stats in operations:
+                for error_type, count in sorted(stats.errors.items()):
+                    lines.append(f'hotel_operation_errors_total{{operation="{name}",error="{error_type}"}} {count}')
+
+            for counter, description in (('rows', 'Rows scanned, read or written by each operation.'),
+                                         ('bytes_read', 'Bytes read from disk by each operation.'),
+                                         ('bytes_written', 'Bytes written to disk by each operation.')):
+                lines += [f'# HELP hotel_operation_{counter}_total {description}',
+                          f'# TYPE hotel_operation_{counter}_total counter']
+                for name, stats in operations:
+                    if getattr(stats, counter):
+                        lines.append(f'hotel_operation_{counter}_total{{operation="{name}"}} {getattr(stats, counter)}')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the totals to a file, as JSON if its name ends in .json and as Prometheus text otherwise
+    def write(self, file_name):
+        try:
+            with open(file_name, 'w') as file:
+                file.write(self.to_json() if file_name.endswith('.json') else self.to_prometheus())
+        except Exception as e:
+            raise Exception(f"An error occurred while writing the file '{file_name}': {e}") from e
+
+
+# The metrics of this process, shared by every module
+metrics = Metrics(os.environ.get('HOTEL_METRICS', '') not in ('', '0'))
@@ -0,0 +1,130 @@
+# Dynamic pricing for the hotel booking system. The price per night in hotel_room.csv is the base rate of a room;
+# the rate plans in rate_plans.csv (next to hotel_room.csv) raise or lower it with these rules:
+#   weekend    applies to the nights starting on Friday and Saturday
+#   season     applies to the nights from one DD/MM date to another, every year (e.g. 20/12 to 02/01)
+#   occupancy  applies to the whole stay once at least the given fraction of the rooms of its type are taken for it
+# Each rule names a room type, or '*' for every type, and a multiplier. The multipliers of all the weekend and season
+# rules that apply to a night are multiplied together; of the occupancy rules only the one with the highest
+# threshold that has been reached applies. Without a rate_plans.csv every night costs the base rate.
+# rate_plans.example.csv shows the format. Copy it to rate_plans.csv and adjust it to start charging these prices;
+# from then on every search and booking uses them.
+import csv
+import os
+from datetime import date
+from itertools import accumulate
+
+
+# Parses a recurring DD/MM date into a (month, day) pair that can be compared with other dates of the year
+def parse_day_of_year(day_str):
+    day, month = day_str.split('/')
+    return int(month), int(day)
+
+
+# Reads the rules of rate_plans.csv. A missing file means there are no rules, so every night costs the base rate.
+def read_rate_plans(file_name):
+    rules = []
+    try:
+        with open(file_name, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader)  # Skips header row
+            for row in reader:
+                if not row:
+                    continue
+                room_type, rule, start, end, multiplier = row
+                if rule == 'season':
+                    start, end = parse_day_of_year(start), parse_day_of_year(end)
+                elif rule == 'occupancy':
+                    start = float(start)
+                elif rule != 'weekend':
+                    raise ValueError(f"Unknown rule '{rule}'.")
+                rules.append({'room_type': room_type, 'rule': rule, 'start': start, 'end': end,
+                              'multiplier': float(multiplier)})
+        return rules
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        raise Exception(f"An error occurred while reading the file '{file_name}': {e}") from e
+
+
+# PricingEngine prices stays with the rate plans. For every room type it keeps a table of running totals of the
+# nightly multipliers over a window of days, so the multiplier of a stay of any length is the difference of two
+# entries and quoting never loops over the nights. The tables are built the first time a room type is quoted and
+# rebuilt over a wider window when a stay falls outside it, up to MAX_TABLE_DAYS; past that they are rebuilt over a
+# new window starting at the stay instead, so one far-off stay can't make every table huge. Stays longer than
+# TABLE_DAYS are priced night by night without a table.
+class PricingEngine:
+    TABLE_DAYS = 730  # Number of days a table covers when it is built
+    MAX_TABLE_DAYS = 2920  # Number of days a table can grow to cover
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.first_day = None  # Day ordinal of the first night in the tables
+        self.last_day = None  # Day ordinal of the day after the last night in the tables
+        self.multiplier_sums = {}  # Room type -> running totals of the nightly multipliers, starting at 0
+
+    # Creates an engine from the rate plans file next to a hotel_room.csv (or database) file
+    @classmethod
+    def for_room_file(cls, room_file_name):
+        return cls(read_rate_plans(os.path.join(os.path.dirname(room_file_name), 'rate_plans.csv')))
+
+    # Returns the rules that apply to the room type
+    def rules_for(self, room_type, rule):
+        return [plan for plan in self.rules if plan['rule'] == rule and plan['room_type'] in ('*', room_type)]
+
+    # Returns the multiplier of the night starting on the given day
+    def nightly_multiplier(self, weekend_rules, season_rules, day):
+        multiplier = 1.0
+        if day.weekday() in (4, 5):
+            for plan in weekend_rules:
+                multiplier *= plan['multiplier']
+        day_of_year = (day.month, day.day)
+        for plan in season_rules:
+            start, end = plan['start'], plan['end']
+            # Seasons such as 20/12 to 02/01 run over the end of the year
+            if (start <= day_of_year <= end) if start <= end else (day_of_year >= start or day_of_year <= end):
+                multiplier *= plan['multiplier']
+        return multiplier
+
+    # Returns the table of running totals for the room type, making sure it covers the nights check_in to check_out
+    def table_for(self, room_type, check_in, check_out):
+        if self.first_day is None or check_in < self.first_day or check_out > self.last_day:
+            first_day = min(check_in, self.first_day if self.first_day is not None else check_in)
+            last_day = max(check_out, self.last_day if self.last_day is not None else check_out,
+                           first_day + self.TABLE_DAYS)
+            if last_day - first_day > self.MAX_TABLE_DAYS:
+                first_day, last_day = check_in, check_in + self.TABLE_DAYS
+            self.first_day, self.last_day = first_day, last_day
+            self.multiplier_sums = {}
+
+        multiplier_sums = self.multiplier_sums.get(room_type)
+        if multiplier_sums is None:
+            weekend_rules = self.rules_for(room_type, 'weekend')
+            season_rules = self.rules_for(room_type, 'season')
+            multiplier_sums = list(accumulate(
+                (self.nightly_multiplier(weekend_rules, season_rules, date.fromordinal(day))
+                 for day in range(self.first_day, self.last_day)), initial=0.0))
+            self.multiplier_sums[room_type] = multiplier_sums
+        return multiplier_sums
+
+    # Returns the sum of the nightly multipliers of the nights check_in to check_out
+    def stay_multiplier(self, room_type, check_in, check_out):
+        if check_out - check_in > self.TABLE_DAYS:
+            weekend_rules = self.rules_for(room_type, 'weekend')
+            season_rules = self.rules_for(room_type, 'season')
+            return sum(self.nightly_multiplier(weekend_rules, season_rules, date.fromordinal(day))
+                       for day in range(check_in, check_out))
+        multiplier_sums = self.table_for(room_type, check_in, check_out)
+        return multiplier_sums[check_out - self.first_day] - multiplier_sums[check_in - self.first_day]
+
+    # Returns the multiplier for a stay whose room type is the given fraction taken
+    def occupancy_multiplier(self, room_type, occupancy):
+        reached = [plan for plan in self.rules_for(room_type, 'occupancy') if occupancy >= plan['start']]
+        return max(reached, key=lambda plan: plan['start'])['multiplier'] if reached else 1.0
+
+    # Returns the total price of the nights check_in to check_out (day ordinals, check_out not included) in a room
+    # with the given base rate, rounded to cents
+    def quote(self, room_type, price_per_night, check_in, check_out, occupancy=0.0):
+        if check_out < check_in:
+            raise ValueError("Check-out date must be after the check-in date.")
+        nights = self.stay_multiplier(room_type, check_in, check_out)
+        return round(price_per_night * nights * self.occupancy_multiplier(room_type, occupancy), 2)
@@ -0,0 +1,141 @@
+# Multi-property support for hotel chains. Every property (hotel) of the chain is a shard with its own room and
+# reservations files and its own RoomManager and ReservationManager, listed in properties.csv:
+#   Property ID,Name,City,Room File,Reservation File
+# File names are relative to the directory of properties.csv. Searching all properties fans the search out over a
+# pool of worker processes and merges the options of every property, cheapest stay first.
+# Usage: python properties.py <check-in DD/MM/YYYY> <check-out DD/MM/YYYY> <number of people> [city]
+import csv
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from common_functionalities import HotelManager, RoomManager, ReservationManager, Validator
+
+# Property ID -> HotelManager of the properties this process has opened. Every worker process keeps its own.
+shards = {}
+
+
+# Reads properties.csv into a dictionary keyed by property ID
+def read_property_data(file_name):
+    directory = os.path.dirname(file_name)
+    properties = {}
+    try:
+        with open(file_name, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader)  # Skips header row
+            for row in reader:
+                if not row:
+                    continue
+                property_id, name, city, room_file, reservation_file = row
+                properties[property_id] = {'property_id': property_id, 'name': name, 'city': city,
+                                           'room_file': os.path.join(directory, room_file),
+                                           'reservation_file': os.path.join(directory, reservation_file)}
+        return properties
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"Error: File '{file_name}' not found.") from e
+    except Exception as e:
+        raise Exception(f"An error occurred while reading the file '{file_name}': {e}") from e
+
+
+# Returns the HotelManager of a property, opening its files the first time it is used in this process
+def open_shard(property_info):
+    hotel_manager = shards.get(property_info['property_id'])
+    if hotel_manager is None:
+        validator = Validator()
+        hotel_manager = HotelManager(RoomManager(property_info['room_file'], validator),
+                                     ReservationManager(property_info['reservation_file']), validator)
+        shards[property_info['property_id']] = hotel_manager
+    return hotel_manager
+
+
+# Searches one property and labels its options with the property. Runs in a worker process, where the property
+# stays open between searches, so only the first search of a property reads its files.
+def search_property(property_info, check_in_date, check_out_date, num_people):
+    try:
+        hotel_manager = open_shard(property_info)
+        available_rooms = hotel_manager.room_manager.filter_room_options(check_in_date, check_out_date, num_people,
+                                                                         hotel_manager.reservation_manager)
+    except Exception as e:
+        raise Exception(f"An error occurred while searching {property_info['name']}: {e}") from e
+    return [dict(room, property_id=property_info['property_id'], property_name=property_info['name'],
+                 city=property_info['city']) for room in available_rooms]
+
+
+# PropertyManager gives access to every property of the chain and searches them all at once. Each worker process
+# has its own single-process pool and each property is always searched by the same worker, so a property is only
+# loaded into one worker and its availability index and search cache stay warm there.
+class PropertyManager:
+    PROPERTY_FILE = "properties.csv"
+
+    def __init__(self, file_name=PROPERTY_FILE, max_workers=None):
+        self.properties = read_property_data(file_name)
+        self.max_workers = max_workers or min(len(self.properties), os.cpu_count() or 1) or 1
+        self.validator = Validator()
+        self.workers = None  # Created on the first search that needs them
+
+    # Returns the properties in a city, or every property if no city is given
+    def find_properties(self, city=None):
+        return [property_info for property_info in self.properties.values()
+                if city is None or property_info['city'].lower() == city.lower()]
+
+    # Returns the HotelManager of a property, e.g. to book the option a search returned
+    def hotel_manager(self, property_id):
+        if property_id not in self.properties:
+            raise ValueError(f"Unknown property '{property_id}'.")
+        return open_shard(self.properties[property_id])
+
+    # Starts the worker processes. They are started with 'spawn' rather than forked, so they never inherit locks
+    # held by other threads of this process (the GUI and booking service search on worker threads).
+    def start_workers(self):
+        if self.workers is None:
+            context = multiprocessing.get_context('spawn')
+            self.workers = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(self.max_workers)]
+        return self.workers
+
+    # Searches every property (or those in a city) for the stay and returns all the options, each labelled with its
+    # property_id, property_name and city, cheapest stay first. The properties are searched in parallel by the
+    # worker processes; a single property is searched in this process instead.
+    def search_all_properties(self, check_in_date, check_out_date, num_people, city=None, limit=None):
+        self.validator.validate_num_people(num_people)
+        self.validator.validate_date_range(check_in_date, check_out_date)
+        properties = self.find_properties(city)
+
+        if len(properties) < 2 or self.max_workers == 1:
+            results = [search_property(property_info, check_in_date, check_out_date, num_people)
+                       for property_info in properties]
+        else:
+            workers = self.start_workers()
+            positions = {property_id: position for position, property_id in enumerate(self.properties)}
+            futures = [workers[positions[property_info['property_id']] % len(workers)].submit(
+                search_property, property_info, check_in_date, check_out_date, num_people)
+                for property_info in properties]
+            results = [future.result() for future in futures]
+
+        available_rooms = sorted((room for rooms in results for room in rooms),
+                                 key=lambda room: (room['total_price'], room['property_name'], room['room_type']))
+        return available_rooms[:limit] if limit is not None else available_rooms
+
+    # Stops the worker processes
+    def close(self):
+        for worker in self.workers or []:
+            worker.shutdown()
+        self.workers = None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python properties.py <check-in DD/MM/YYYY> <check-out DD/MM/YYYY> <number of people> [city]")
+        sys.exit(1)
+    property_manager = PropertyManager()
+    try:
+        for option in property_manager.search_all_properties(sys.argv[1], sys.argv[2], int(sys.argv[3]),
+                                                             sys.argv[4] if len(sys.argv) > 4 else None):
+            print(f"{option['property_name']} ({option['city']}) - {option['room_type']} - "
+                  f"Price: ${option['price_per_night']:.2f} - Total: ${option['total_price']:.2f} - "
+                  f"{option['available_count']} left")
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        property_manager.close()
@@ -0,0 +1,72 @@
+# Implements a text-based console for the hotel's occupancy and revenue reports
+# Usage: python report_console.py [from DD/MM/YYYY] [to DD/MM/YYYY] [day|week|month]
+# Without arguments the console asks for the dates and period of each report.
+import sys
+
+from common_functionalities import RoomManager, ReservationManager, Validator
+from reports import PERIODS, ReportManager
+
+
+# This class lets hotel staff view occupancy, ADR, RevPAR and revenue for a range of dates via the console
+class ReportConsole:
+    # Initialises a 'ReportManager' with the same room and reservation files as the booking console
+    def __init__(self):
+        self.validator = Validator()
+        self.report_manager = ReportManager(RoomManager("hotel_room.csv", self.validator),
+                                            ReservationManager("reservations.csv"))
+
+    # Prints a report as a table, leaving a blank line between periods
+    def print_report(self, start_date, end_date, period):
+        report = self.report_manager.performance_report(start_date, end_date, period)
+        print(f"{'Period':<12}{'Room Type':<18}{'Sold':>6}{'Available':>11}{'Occupancy':>11}{'Revenue':>12}"
+              f"{'ADR':>10}{'RevPAR':>10}")
+        for line in report:
+            print(f"{line['period']:<12}{line['room_type']:<18}{line['room_nights_sold']:>6}"
+                  f"{line['room_nights_available']:>11}{line['occupancy']:>10.1%} {line['revenue']:>11.2f}"
+                  f"{line['adr']:>10.2f}{line['revpar']:>10.2f}")
+            if line['room_type'] == 'All':
+                print()
+
+    # Asks for the dates and period of a report until valid ones are given
+    def ask_for_report(self):
+        while True:
+            start_date = input("Enter the first date of the report (DD/MM/YYYY): ")
+            end_date = input("Enter the date after the last night of the report (DD/MM/YYYY): ")
+            try:
+                self.validator.validate_date_range(start_date, end_date, max_nights=None)
+                break
+            except ValueError as ve:
+                print(f"Error: {ve}")
+        while True:
+            period = input("Show the report per day, week or month? ").strip().lower()
+            if period in PERIODS:
+                break
+            print("Error: Please enter day, week or month.")
+        print("--------------------------------------------------------------")
+        return start_date, end_date, period
+
+    # Shows reports until the user chooses to exit
+    def run(self):
+        while True:
+            try:
+                self.print_report(*self.ask_for_report())
+            except Exception as e:
+                print(f"Error: {e}")
+            if input("Would you like to see another report? (yes/no): ").strip().lower() != 'yes':
+                print("Exiting reports...")
+                break
+
+
+if __name__ == "__main__":
+    report_console = ReportConsole()
+    if len(sys.argv) > 1:
+        if len(sys.argv) < 3:
+            print("Usage: python report_console.py [from DD/MM/YYYY] [to DD/MM/YYYY] [day|week|month]")
+            sys.exit(1)
+        try:
+            report_console.print_report(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else 'day')
+        except Exception as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    else:
+        report_console.run()
@@ -0,0 +1,165 @@
+# Occupancy and revenue reports for the hotel booking system. For every day, week or month of a date range the
+# reports give, per room type and for the whole hotel:
+#   occupancy  room-nights sold / room-nights available
+#   ADR        average daily rate, revenue / room-nights sold
+#   RevPAR     revenue per available room, revenue / room-nights available
+# The price of a stay is spread evenly over its nights. Each stay is recorded once in a difference array per room
+# type (+1 room and +nightly rate on its first night, -1 and -rate after its last) and running totals over the arrays
+# give the rooms sold and revenue of every night, so a report takes one pass over the reservations whatever the
+# length of the range. NumPy is used when it is installed, and with the columnar store the stays are read straight
+# from its memory-mapped columns instead of from Reservation records.
+from datetime import timedelta
+from itertools import accumulate
+
+from common_functionalities import np, to_date
+
+PERIODS = ('day', 'week', 'month')
+
+
+# Returns the label of the day, week (starting on Monday) or month a date belongs to
+def period_label(day, period):
+    if period == 'day':
+        return day.isoformat()
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{day.year}-{day.month:02d}"
+
+
+# ReportManager works out the reports from the rooms of a RoomManager and the reservations of a ReservationManager
+class ReportManager:
+    def __init__(self, room_manager, reservation_manager):
+        self.room_manager = room_manager
+        self.reservation_manager = reservation_manager
+        self.room_types = list(room_manager.room_types)
+        self.type_rows = {room_type: row for row, room_type in enumerate(self.room_types)}
+
+    # Returns the stays that overlap the nights start to end (day ordinals, end not included), clipped to them, as
+    # four sequences: room type row, first night and night after the last (both counted from start), and the
+    # nightly rate. Stays in rooms the hotel no longer has are left out, and so are stays that don't last a night (e.g.
+    # hand-edited rows with the dates the wrong way round).
+    def collect_stays(self, start, end):
+        storage = self.reservation_manager.storage
+        if np is not None and hasattr(storage, 'read_columns'):
+            return self.collect_stays_from_columns(storage, start, end)
+
+        type_rows, firsts, lasts, rates = [], [], [], []
+        for reservation in self.reservation_manager.read_reservation_data():
+            check_in = reservation.check_in.toordinal()
+            check_out = reservation.check_out.toordinal()
+            type_row = self.type_rows.get(self.room_type_of(reservation.room_id, reservation.room_type))
+            if type_row is None or check_in >= end or check_out <= start or check_out <= check_in:
+                continue
+            type_rows.append(type_row)
+            firsts.append(max(check_in, start) - start)
+            lasts.append(min(check_out, end) - start)
+            rates.append(reservation.total_price / (check_out - check_in))
+        return type_rows, firsts, lasts, rates
+
+    # Returns the room type of a stay: the type of its room, or the type it was booked as if it has no room ID
+    def room_type_of(self, room_id, room_type):
+        if room_id is None:
+            return room_type
+        room_info = self.room_manager.rooms.get(room_id)
+        return room_info['room_type'] if room_info else None
+
+    # collect_stays for the columnar store: selects and clips the stays with NumPy over the memory-mapped columns,
+    # so no Reservation records are touched apart from the few made before rooms were allocated individually
+    def collect_stays_from_columns(self, storage, start, end):
+        with self.reservation_manager.lock.shared:
+            self.reservation_manager.refresh()
+            columns = storage.read_columns()
+            references = storage.references
+            room_ids = columns['room_id']
+            check_ins = columns['check_in']
+            check_outs = columns['check_out']
+
+            live = np.ones(len(room_ids), dtype=bool)
+            live[columns['cancelled']] = False
+            selected = np.nonzero(live & (check_ins < end) & (check_outs > start) & (check_outs > check_ins))[0]
+
+            # Looks up the type of every room with a table indexed by room ID
+            type_of_room = np.full(max(max(self.room_manager.rooms, default=0), int(room_ids.max(initial=0))) + 1, -1)
+            for room_id, room_info in self.room_manager.rooms.items():
+                type_of_room[room_id] = self.type_rows[room_info['room_type']]
+            selected_room_ids = room_ids[selected]
+            type_rows = np.where(selected_room_ids >= 0, type_of_room[np.maximum(selected_room_ids, 0)], -1)
+            for position in np.nonzero(selected_room_ids < 0)[0]:
+                reservation = self.reservation_manager.reservations.get(references[selected[position]])
+                if reservation is not None:
+                    type_rows[position] = self.type_rows.get(reservation.room_type, -1)
+
+        known = type_rows >= 0
+        selected, type_rows = selected[known], type_rows[known]
+        check_ins, check_outs = check_ins[selected].astype(np.int64), check_outs[selected].astype(np.int64)
+        rates = columns['total_price'][selected] / (check_outs - check_ins)
+        return (type_rows, np.maximum(check_ins, start) - start, np.minimum(check_outs, end) - start, rates)
+
+    # Returns the number of rooms sold and the revenue of every night from start to end (day ordinals, end not
+    # included) for every room type, as two lists of rows in the order of room_types
+    def nightly_totals(self, start, end):
+        num_nights = end - start
+        type_rows, firsts, lasts, rates = self.collect_stays(start, end)
+
+        if np is not None:
+            sold = np.zeros((len(self.room_types), num_nights + 1), dtype=np.int64)
+            revenue = np.zeros((len(self.room_types), num_nights + 1))
+            type_rows, firsts, lasts = (np.asarray(values, dtype=np.intp) for values in (type_rows, firsts, lasts))
+            rates = np.asarray(rates, dtype=float)
+            np.add.at(sold, (type_rows, firsts), 1)
+            np.add.at(sold, (type_rows, lasts), -1)
+            np.add.at(revenue, (type_rows, firsts), rates)
+            np.add.at(revenue, (type_rows, lasts), -rates)
+            return (np.cumsum(sold[:, :num_nights], axis=1).tolist(),
+                    np.cumsum(revenue[:, :num_nights], axis=1).tolist())
+
+        sold = [[0] * (num_nights + 1) for _ in self.room_types]
+        revenue = [[0.0] * (num_nights + 1) for _ in self.room_types]
+        for type_row, first, last, rate in zip(type_rows, firsts, lasts, rates):
+            sold[type_row][first] += 1
+            sold[type_row][last] -= 1
+            revenue[type_row][first] += rate
+            revenue[type_row][last] -= rate
+        return ([list(accumulate(changes[:num_nights])) for changes in sold],
+                [list(accumulate(changes[:num_nights])) for changes in revenue])
+
+    # Works out occupancy, ADR, RevPAR and revenue for every day, week or month from start_date up to (but not
+    # including) end_date. Weeks and months at the ends of the range only count the nights inside it. The dates can
+    # be DD/MM/YYYY strings or already parsed dates. Returns a list of dictionaries, one per period and room type,
+    # each followed by the totals of the whole hotel under the room type 'All'.
+    def performance_report(self, start_date, end_date, period='day'):
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period '{period}'. Please use day, week or month.")
+        start_day = to_date(start_date)
+        start = start_day.toordinal()
+        end = to_date(end_date).toordinal()
+        if end <= start:
+            raise ValueError("The end date must be after the start date.")
+        sold, revenue = self.nightly_totals(start, end)
+
+        # Splits the nights into runs of the same period
+        labels = [period_label(start_day + timedelta(days=night), period) for night in range(end - start)]
+        boundaries = [night for night in range(len(labels)) if night == 0 or labels[night] != labels[night - 1]]
+        boundaries.append(len(labels))
+
+        room_counts = [len(self.room_manager.room_types[room_type]) for room_type in self.room_types]
+        report = []
+        for first, last in zip(boundaries, boundaries[1:]):
+            totals = []
+            for row, room_type in enumerate(self.room_types):
+                totals.append((room_type, room_counts[row] * (last - first), sum(sold[row][first:last]),
+                               sum(revenue[row][first:last])))
+            totals.append(('All', sum(total[1] for total in totals), sum(total[2] for total in totals),
+                           sum(total[3] for total in totals)))
+            for room_type, available, rooms_sold, period_revenue in totals:
+                report.append({
+                    'period': labels[first],
+                    'room_type': room_type,
+                    'room_nights_available': available,
+                    'room_nights_sold': rooms_sold,
+                    'occupancy': rooms_sold / available if available else 0.0,
+                    'revenue': round(period_revenue, 2),
+                    'adr': round(period_revenue / rooms_sold, 2) if rooms_sold else 0.0,
+                    'revpar': round(period_revenue / available, 2) if available else 0.0
+                })
+        return report
@@ -0,0 +1,356 @@
+# Shared-memory occupancy index, so several worker processes can answer room searches without each loading the
+# reservations and building its own availability index. One writer process keeps a day map of every room in a
+# multiprocessing.shared_memory block up to date; any number of reader processes attach to the block and search it
+# without taking a lock.
+#
+# The data block of generation N (named <base name>_N) holds:
+#   header     int64 sequence, base day ordinal, number of days, number of rooms, retired flag
+#   room IDs   int32 per room, giving the room of every row of the day map
+#   day map    uint8 per room per day from the base day on: the number of stays booked for that night
+# A small control block (<base name>_control) holds the current generation, the writer's process ID and the time the
+# writer last picked up changes (its heartbeat). When a stay falls outside the days the map covers, the writer copies
+# the map into a larger block of the next generation, switches the control block over and marks the old block as
+# retired, and readers move to the new block.
+#
+# Updates use a sequence lock: the writer makes the sequence odd before changing the map and even again afterwards.
+# A reader notes the sequence, reads, and reads again if the sequence was odd or has changed in the meantime, so it
+# never uses a half-written map and the writer never waits for readers. A reader that can't get a consistent read
+# after a few attempts, or finds that the writer has stopped, exited or not picked up changes for HEARTBEAT_TIMEOUT
+# seconds, raises SharedIndexUnavailable rather than search a map nobody keeps up to date; RoomManager then searches
+# its own availability index instead. A writer therefore has to call refresh() at least every few seconds.
+#
+# Running this file keeps the shared index of a reservations file up to date until it is stopped:
+#   python shared_occupancy.py hotel_room.csv reservations.csv
+import hashlib
+import os
+import struct
+import sys
+import time
+from datetime import date
+from multiprocessing import resource_tracker, shared_memory
+
+from common_functionalities import RoomManager, ReservationManager, Validator
+
+HEADER = struct.Struct('<qqqqq')
+SEQUENCE_OFFSET = 0
+RETIRED_OFFSET = 32
+CONTROL = struct.Struct('<qqd')  # Generation, writer process ID (0 while starting or after closing), heartbeat time
+HEARTBEAT_TIMEOUT = 5.0
+
+
+# Raised by a reader when the shared index can't be searched, e.g. because its writer has stopped
+class SharedIndexUnavailable(Exception):
+    pass
+
+
+# Returns the base name of the shared memory blocks for a reservations file, which every process works out the same
+def shared_index_name(reservation_file_name):
+    return 'hotel_' + hashlib.sha1(os.path.abspath(reservation_file_name).encode('utf-8')).hexdigest()[:16]
+
+
+# Takes a shared memory block out of Python's resource tracker. Before Python 3.13 the tracker destroys every block a
+# process has attached to when it exits, and a process shares its tracker with the processes it starts, so readers
+# would destroy the writer's blocks. The writer removes its blocks itself instead, and replaces any left behind by a
+# writer that crashed when it starts.
+def untrack(block):
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+# Closes and destroys a block that has been taken out of the tracker
+def remove_block(block):
+    block.close()
+    resource_tracker.register(block._name, 'shared_memory')  # unlink() takes the block out of the tracker again
+    block.unlink()
+
+
+# Attaches to an existing shared memory block
+def attach_block(name):
+    return untrack(shared_memory.SharedMemory(name))
+
+
+# Removes the blocks of the shared index of a reservations file that a writer which didn't shut down cleanly left
+# behind. Blocks of older generations are removed by the writer as it grows the index, so only the control block and
+# the block of the current generation can be left.
+def remove_shared_index(reservation_file_name):
+    name = shared_index_name(reservation_file_name)
+    try:
+        control = attach_block(name + '_control')
+    except FileNotFoundError:
+        return
+    generation = CONTROL.unpack_from(control.buf, 0)[0]
+    remove_block(control)
+    try:
+        remove_block(attach_block(f"{name}_{generation}"))
+    except FileNotFoundError:
+        pass
+
+
+# Reads one data block: the layout described above, with the room IDs mapped to their rows
+class OccupancyBlock:
+    def __init__(self, block):
+        self.block = block
+        _, self.base_day, self.day_count, room_count, _ = HEADER.unpack_from(block.buf, 0)
+        room_ids = struct.unpack_from(f'<{room_count}i', block.buf, HEADER.size)
+        self.rows = {room_id: row for row, room_id in enumerate(room_ids)}
+        self.day_map_start = HEADER.size + 4 * room_count
+        self.free_days = bytes(self.day_count)  # Compared with a room's nights to see whether they are all free
+
+    def sequence(self):
+        return struct.unpack_from('<q', self.block.buf, SEQUENCE_OFFSET)[0]
+
+    def retired(self):
+        return struct.unpack_from('<q', self.block.buf, RETIRED_OFFSET)[0] != 0
+
+    # Returns True if the room has no booked night in [check_in, check_out). Nights outside the map have never been
+    # booked. Rooms that aren't in the map (e.g. added to the room file since) have no bookings either.
+    def is_free(self, room_id, check_in, check_out):
+        row = self.rows.get(room_id)
+        first = max(check_in - self.base_day, 0)
+        last = min(check_out - self.base_day, self.day_count)
+        if row is None or last <= first:
+            return True
+        start = self.day_map_start + row * self.day_count
+        return self.block.buf[start + first:start + last] == self.free_days[:last - first]
+
+    def close(self):
+        self.block.close()
+
+
+# Searches the shared index from any process. It answers the same questions as an AvailabilityIndex, so RoomManager
+# can search it instead of building its own index (see RoomManager.use_shared_index).
+class SharedOccupancyReader:
+    MAX_ATTEMPTS = 50  # Reads tried before giving up, with a growing pause between them (about 0.4 seconds in all)
+
+    def __init__(self, reservation_file_name):
+        self.name = shared_index_name(reservation_file_name)
+        self.control = attach_block(self.name + '_control')
+        self.generation = None
+        self.current = None
+
+    # Makes sure the current generation's block is attached
+    def attach(self):
+        generation = CONTROL.unpack_from(self.control.buf, 0)[0]
+        if self.current is None or generation != self.generation or self.current.retired():
+            if self.current is not None:
+                self.current.close()
+                self.current = None
+            self.current = OccupancyBlock(attach_block(f"{self.name}_{generation}"))
+            self.generation = generation
+        return self.current
+
+    # Returns True if the writer of the control block is running and has picked up changes recently
+    def writer_alive(self):
+        _, pid, heartbeat = CONTROL.unpack_from(self.control.buf, 0)
+        if pid == 0 or time.time() - heartbeat > HEARTBEAT_TIMEOUT:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # The process exists but belongs to another user
+        return True
+
+    # Makes sure a live writer keeps the index up to date, moving to the blocks of a new writer if the one this
+    # reader attached to has been replaced
+    def check_writer(self):
+        if self.writer_alive():
+            return
+        try:
+            control = attach_block(self.name + '_control')
+        except FileNotFoundError:
+            raise SharedIndexUnavailable(f"The shared index '{self.name}' has no writer.")
+        self.control.close()
+        self.control = control
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        if not self.writer_alive():
+            raise SharedIndexUnavailable(f"The writer of the shared index '{self.name}' has stopped.")
+
+    # Calls read with the current block until it has read it without the writer changing it in the meantime
+    def read_consistently(self, read):
+        self.check_writer()
+        delay = 0.0001
+        for _ in range(self.MAX_ATTEMPTS):
+            try:
+                current = self.attach()
+            except FileNotFoundError:
+                current = None  # The writer has moved on to yet another block since the control block was read
+            if current is not None:
+                before = current.sequence()
+                if not before % 2:  # Otherwise the writer is part way through a change
+                    result = read(current)
+                    if current.sequence() == before and not current.retired():
+                        return result
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+        self.check_writer()
+        raise SharedIndexUnavailable(f"The shared index '{self.name}' kept changing while it was read.")
+
+    # Returns a value that changes whenever the index does
+    def version(self):
+        return self.read_consistently(lambda current: (self.generation, current.sequence()))
+
+    def is_free(self, room_id, check_in, check_out):
+        return self.read_consistently(lambda current: current.is_free(room_id, check_in, check_out))
+
+    # Returns the room IDs from the given list that are free for the whole stay, keeping their order
+    def free_rooms(self, room_ids, check_in, check_out):
+        return self.read_consistently(lambda current: [room_id for room_id in room_ids
+                                                       if current.is_free(room_id, check_in, check_out)])
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+        self.control.close()
+
+
+# Keeps the shared index up to date. It listens to a ReservationManager like the availability index does, so the
+# reservations this process writes are in the index straight away; refresh() picks up those written by other
+# processes. Only one writer may run per reservations file.
+class SharedOccupancyWriter:
+    MARGIN_DAYS = 365  # Extra days added on the side a new block has to grow, so the map doesn't grow every day
+
+    def __init__(self, room_manager, reservation_manager):
+        self.room_manager = room_manager
+        self.reservation_manager = reservation_manager
+        self.name = shared_index_name(reservation_manager.file_name)
+        self.room_ids = sorted(room_manager.rooms)
+        self.stays = {}  # Reference number -> (row, check_in, check_out) so a cancellation can clear its nights
+
+        remove_shared_index(reservation_manager.file_name)
+        with reservation_manager.read_lock:
+            reservation_manager.refresh()
+            reservations = reservation_manager.reservations.values()
+            first_day = min((reservation.check_in for reservation in reservations), default=date.today()).toordinal()
+            last_day = max((reservation.check_out.toordinal() for reservation in reservations if
+                            reservation.check_out > reservation.check_in), default=first_day) + self.MARGIN_DAYS
+            self.control = self.create_block(self.name + '_control', CONTROL.size)
+            CONTROL.pack_into(self.control.buf, 0, 0, 0, 0.0)
+            self.generation = 0
+            self.current = self.create_data_block(0, first_day, last_day - first_day)
+            for reservation in reservations:
+                self.reservation_added(reservation)
+            reservation_manager.add_listener(self)
+            self.beat()  # Readers only use the index from now on
+
+    # Creates a shared memory block, replacing one left behind by a writer that didn't shut down cleanly
+    def create_block(self, name, size):
+        try:
+            return untrack(shared_memory.SharedMemory(name, create=True, size=size))
+        except FileExistsError:
+            remove_block(attach_block(name))
+            return untrack(shared_memory.SharedMemory(name, create=True, size=size))
+
+    # Creates the data block of a generation, with an empty day map
+    def create_data_block(self, generation, base_day, day_count):
+        room_count = len(self.room_ids)
+        block = self.create_block(f"{self.name}_{generation}",
+                                  HEADER.size + 4 * room_count + room_count * day_count)
+        HEADER.pack_into(block.buf, 0, 0, base_day, day_count, room_count, 0)
+        struct.pack_into(f'<{room_count}i', block.buf, HEADER.size, *self.room_ids)
+        return OccupancyBlock(block)
+
+    def set_sequence(self, block, sequence):
+        struct.pack_into('<q', block.block.buf, SEQUENCE_OFFSET, sequence)
+
+    # Moves the index to a block that also covers the nights check_in to check_out
+    def grow(self, check_in, check_out):
+        old = self.current
+        base_day = check_in - self.MARGIN_DAYS if check_in < old.base_day else old.base_day
+        end_day = old.base_day + old.day_count
+        if check_out > end_day:
+            end_day = check_out + self.MARGIN_DAYS
+        new = self.create_data_block(self.generation + 1, base_day, end_day - base_day)
+        shift = old.base_day - base_day
+        for row in range(len(self.room_ids)):
+            start = new.day_map_start + row * new.day_count + shift
+            old_start = old.day_map_start + row * old.day_count
+            new.block.buf[start:start + old.day_count] = old.block.buf[old_start:old_start + old.day_count]
+
+        self.generation += 1
+        _, pid, heartbeat = CONTROL.unpack_from(self.control.buf, 0)
+        CONTROL.pack_into(self.control.buf, 0, self.generation, pid, heartbeat)
+        sequence = old.sequence()
+        self.set_sequence(old, sequence + 1)
+        struct.pack_into('<q', old.block.buf, RETIRED_OFFSET, 1)
+        self.set_sequence(old, sequence + 2)
+        self.current = new
+        remove_block(old.block)
+
+    # Adds 'change' (1 or -1) to the nights check_in to check_out of the room in the given row, inside the sequence
+    # lock so readers never see half of the change
+    def change_nights(self, row, check_in, check_out, change):
+        if check_in < self.current.base_day or check_out > self.current.base_day + self.current.day_count:
+            self.grow(check_in, check_out)
+        current = self.current
+        start = current.day_map_start + row * current.day_count + check_in - current.base_day
+        stop = start + check_out - check_in
+        nights = bytes(min(max(count + change, 0), 255) for count in current.block.buf[start:stop])
+        sequence = current.sequence()
+        self.set_sequence(current, sequence + 1)
+        current.block.buf[start:stop] = nights
+        self.set_sequence(current, sequence + 2)
+
+    # Called by the ReservationManager whenever a new reservation is written or picked up. Stays that don't last a
+    # night book nothing, as in the availability index.
+    def reservation_added(self, reservation):
+        check_in = reservation.check_in.toordinal()
+        check_out = reservation.check_out.toordinal()
+        if check_out <= check_in:
+            return
+        room_id = reservation.room_id
+        if room_id is None:
+            # Reservations made before rooms were allocated individually are placed like the availability index
+            # places them: in the first room of their type that is free for the stay
+            room_ids = self.room_manager.room_types.get(reservation.room_type)
+            if not room_ids:
+                return
+            free_room_ids = [room_id for room_id in room_ids if self.current.is_free(room_id, check_in, check_out)]
+            room_id = free_room_ids[0] if free_room_ids else room_ids[0]
+        row = self.current.rows.get(room_id)
+        if row is None:
+            return
+        self.change_nights(row, check_in, check_out, 1)
+        self.stays[reservation.reference_number] = (row, check_in, check_out)
+
+    # Called by the ReservationManager whenever a reservation is cancelled
+    def reservation_removed(self, reservation):
+        stay = self.stays.pop(reservation.reference_number, None)
+        if stay is not None:
+            self.change_nights(*stay, -1)
+
+    # Tells readers that the writer is running and the index is up to date
+    def beat(self):
+        CONTROL.pack_into(self.control.buf, 0, self.generation, os.getpid(), time.time())
+
+    # Picks up the reservations other processes have made or cancelled
+    def refresh(self):
+        self.reservation_manager.refresh()
+        self.beat()
+
+    # Removes the shared memory blocks; readers still attached keep their copies until they close them, but stop
+    # searching them
+    def close(self):
+        self.reservation_manager.listeners.remove(self)
+        CONTROL.pack_into(self.control.buf, 0, self.generation, 0, 0.0)
+        remove_block(self.current.block)
+        remove_block(self.control)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python shared_occupancy.py <hotel_room.csv> <reservations.csv>")
+        sys.exit(1)
+    writer = SharedOccupancyWriter(RoomManager(sys.argv[1], Validator()), ReservationManager(sys.argv[2]))
+    print(f"Sharing the occupancy of {sys.argv[2]} as '{writer.name}'. Press Ctrl+C to stop.", flush=True)
+    try:
+        while True:
+            time.sleep(0.2)
+            writer.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
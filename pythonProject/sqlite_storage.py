@@ -0,0 +1,247 @@
+# SQLite storage backend for the hotel booking system. ReservationManager and RoomManager use it instead of the CSV
+# files when they are given a '.db', '.sqlite' or '.sqlite3' file name, so the text console and GUI work the same way
+# with either backend.
+# Running this file imports the existing CSV files into a database:
+#   python sqlite_storage.py hotel_room.csv reservations.csv hotel.db
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date
+
+from common_functionalities import CsvReservationStorage, Reservation, RoomManager, Validator
+from metrics import metrics
+
+
+# Stores rooms and reservations in a SQLite database. The database runs in WAL mode so readers never block the
+# writer, dates are stored as day ordinals, and every query is a fixed SQL string with parameters so sqlite3
+# prepares it once and reuses it from its statement cache.
+# Triggers record every reservation inserted or deleted, by any connection, in the reservation_changes table, so
+# picking up what other processes have changed only reads the changes made since the last one seen instead of every
+# reservation. Once twice CHANGE_LOG_ROWS changes have built up, the next write drops all but the newest
+# CHANGE_LOG_ROWS of them (as does compact()); a process that has fallen further behind than that loads the
+# reservations again.
+class SqliteStorage:
+    LOCK_FREE_READS = True  # SQLite gives every read a consistent view of the database by itself
+    CHANGE_LOG_ROWS = 10000
+    SCHEMA_ATTEMPTS = 50
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rooms (
+            room_id INTEGER PRIMARY KEY,
+            room_type TEXT NOT NULL,
+            max_people INTEGER NOT NULL,
+            price_per_night REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reservations (
+            reference_number TEXT NOT NULL,
+            customer_name TEXT NOT NULL,
+            room_type TEXT NOT NULL,
+            check_in INTEGER NOT NULL,
+            check_out INTEGER NOT NULL,
+            total_price REAL NOT NULL,
+            room_id INTEGER
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS reservations_reference ON reservations (reference_number);
+        DROP INDEX IF EXISTS reservations_room_stay;
+        CREATE TABLE IF NOT EXISTS reservation_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            change TEXT NOT NULL,
+            reference_number TEXT NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS reservation_added AFTER INSERT ON reservations BEGIN
+            INSERT INTO reservation_changes (change, reference_number) VALUES ('added', NEW.reference_number);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reservation_removed AFTER DELETE ON reservations BEGIN
+            INSERT INTO reservation_changes (change, reference_number) VALUES ('removed', OLD.reference_number);
+        END;
+    """
+    SELECT_RESERVATIONS = ("SELECT reference_number, customer_name, room_type, check_in, check_out, total_price, "
+                           "room_id FROM reservations ORDER BY rowid")
+    # Added reservations that have been deleted again since come back without a row
+    SELECT_CHANGES = ("SELECT c.change_id, c.change, c.reference_number, r.reference_number, r.customer_name, "
+                      "r.room_type, r.check_in, r.check_out, r.total_price, r.room_id FROM reservation_changes c "
+                      "LEFT JOIN reservations r ON r.reference_number = c.reference_number WHERE c.change_id > ? "
+                      "ORDER BY c.change_id")
+    SELECT_CHANGE_RANGE = "SELECT MIN(change_id), MAX(change_id) FROM reservation_changes"
+    DELETE_OLD_CHANGES = "DELETE FROM reservation_changes WHERE change_id <= ?"
+    INSERT_RESERVATION = "INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?)"
+    DELETE_RESERVATION = "DELETE FROM reservations WHERE reference_number = ?"
+    SELECT_ROOMS = "SELECT room_id, room_type, max_people, price_per_night FROM rooms ORDER BY room_id"
+    INSERT_ROOM = "INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?)"
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        # The connection can be shared between threads, so every use of it is guarded by a lock
+        self.lock = threading.Lock()
+        try:
+            self.connection = sqlite3.connect(file_name, check_same_thread=False)
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.create_schema()
+            self.data_version = self.read_data_version()
+        except sqlite3.Error as e:
+            raise Exception(f"An error occurred while opening the database '{file_name}': {e}") from e
+        self.change_id = 0  # ID of the last change read or made through this connection
+        self.own_changes = set()  # IDs of changes made through this connection that read_changes hasn't reached yet
+
+    # Switches the database to WAL mode and creates the tables and triggers it doesn't have yet. Processes opening a
+    # new database at the same time can find it locked by the one creating it, as switching the journal mode doesn't
+    # wait for locks, so they try again for a few seconds.
+    def create_schema(self):
+        for attempt in range(self.SCHEMA_ATTEMPTS):
+            try:
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.executescript(self.SCHEMA)
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == self.SCHEMA_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.1)
+
+    # Converts a database row to a Reservation record
+    def to_reservation(self, row):
+        reference_number, customer_name, room_type, check_in, check_out, total_price, room_id = row
+        return Reservation(reference_number, customer_name, room_type, date.fromordinal(check_in),
+                           date.fromordinal(check_out), total_price, room_id)
+
+    # Converts a Reservation record to the parameters of INSERT_RESERVATION
+    def to_parameters(self, reservation):
+        return (reservation.reference_number, reservation.customer_name, reservation.room_type,
+                reservation.check_in.toordinal(), reservation.check_out.toordinal(), reservation.total_price,
+                reservation.room_id)
+
+    # Reads all reservations as Reservation records, in the order they were made. They are read in one transaction
+    # with the ID of the last change, so read_changes carries on from exactly this point.
+    @metrics.instrumented('storage.load')
+    def load(self):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.change_id = self.connection.execute(self.SELECT_CHANGE_RANGE).fetchone()[1] or 0
+                reservations = [self.to_reservation(row) for row in self.connection.execute(self.SELECT_RESERVATIONS)]
+            finally:
+                self.connection.execute("COMMIT")
+            self.own_changes = set()
+            self.data_version = self.read_data_version()
+        metrics.add('storage.read', rows=len(reservations))
+        return reservations
+
+    # Returns SQLite's data version, which changes whenever another connection commits a change to the database
+    def read_data_version(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    # Returns the changes other connections have committed since the last call, as a list of ('added', Reservation)
+    # and ('removed', reference_number) tuples in the order they were made. Returns None if some of them have already
+    # been dropped from the change log by compact(), in which case the reservations have to be loaded again.
+    def read_changes(self):
+        with self.lock:
+            data_version = self.read_data_version()
+            if data_version == self.data_version:
+                return []
+            self.data_version = data_version
+            self.connection.execute("BEGIN")
+            try:
+                first_change_id = self.connection.execute(self.SELECT_CHANGE_RANGE).fetchone()[0]
+                rows = self.connection.execute(self.SELECT_CHANGES, (self.change_id,)).fetchall()
+            finally:
+                self.connection.execute("COMMIT")
+            if first_change_id is not None and first_change_id > self.change_id + 1:
+                return None
+
+            changes = []
+            for change_id, change, reference_number, *reservation in rows:
+                self.change_id = change_id
+                if change_id in self.own_changes:
+                    self.own_changes.discard(change_id)
+                elif change == 'removed':
+                    changes.append(('removed', reference_number))
+                elif reservation[0] is not None:
+                    changes.append(('added', self.to_reservation(reservation)))
+        metrics.add('storage.read', rows=len(changes))
+        return changes
+
+    # Notes the IDs of the changes just made through this connection, so read_changes doesn't pass them on as
+    # changes made by others, and trims the change log once it has grown to twice CHANGE_LOG_ROWS. Callers hold the
+    # lock inside the transaction that made the changes.
+    def note_own_changes(self, count):
+        first_change_id, last_change_id = self.connection.execute(self.SELECT_CHANGE_RANGE).fetchone()
+        if self.change_id == last_change_id - count:
+            self.change_id = last_change_id  # Nobody else has made changes in between, so none are skipped
+        else:
+            self.own_changes.update(range(last_change_id - count + 1, last_change_id + 1))
+        if last_change_id - first_change_id >= 2 * self.CHANGE_LOG_ROWS:
+            self.connection.execute(self.DELETE_OLD_CHANGES, (last_change_id - self.CHANGE_LOG_ROWS,))
+
+    # Saves new reservations in a single transaction
+    def append(self, reservations):
+        with self.lock, self.connection:
+            self.connection.executemany(self.INSERT_RESERVATION,
+                                        [self.to_parameters(reservation) for reservation in reservations])
+            self.note_own_changes(len(reservations))
+        metrics.add('storage.write', rows=len(reservations))
+
+    # Deletes a cancelled reservation
+    def remove(self, reference_number):
+        with self.lock, self.connection:
+            if self.connection.execute(self.DELETE_RESERVATION, (reference_number,)).rowcount:
+                self.note_own_changes(1)
+
+    # Drops all but the newest CHANGE_LOG_ROWS changes from the change log, then moves the contents of the
+    # write-ahead log into the database file and truncates the log
+    @metrics.instrumented('storage.compact')
+    def compact(self):
+        with self.lock:
+            with self.connection:
+                last_change_id = self.connection.execute(self.SELECT_CHANGE_RANGE).fetchone()[1] or 0
+                self.connection.execute(self.DELETE_OLD_CHANGES, (last_change_id - self.CHANGE_LOG_ROWS,))
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # Reads the rooms table into the same dictionary RoomManager builds from hotel_room.csv
+    def read_rooms(self):
+        with self.lock:
+            rows = self.connection.execute(self.SELECT_ROOMS).fetchall()
+        return {room_id: {'room_id': room_id, 'room_type': room_type, 'price_per_night': price_per_night,
+                          'max_people': max_people}
+                for room_id, room_type, max_people, price_per_night in rows}
+
+    # Saves rooms given in the dictionary format used by RoomManager, replacing rooms with the same ID
+    def write_rooms(self, rooms):
+        with self.lock, self.connection:
+            self.connection.executemany(self.INSERT_ROOM,
+                                        [(room['room_id'], room['room_type'], room['max_people'],
+                                          room['price_per_night']) for room in rooms.values()])
+
+    def close(self):
+        self.connection.close()
+
+
+# Imports hotel_room.csv and reservations.csv into a SQLite database. Reservations already in the database are
+# skipped, so the import can be run again safely. Returns the number of rooms and new reservations imported.
+def migrate_csv_to_sqlite(room_file_name, reservation_file_name, database_file_name):
+    rooms = RoomManager(room_file_name, Validator()).rooms
+    reservations = CsvReservationStorage(reservation_file_name).load()
+
+    storage = SqliteStorage(database_file_name)
+    try:
+        storage.write_rooms(rooms)
+        existing = {reservation.reference_number for reservation in storage.load()}
+        new_reservations = []
+        for reservation in reservations:
+            if reservation.reference_number not in existing:
+                existing.add(reservation.reference_number)
+                new_reservations.append(reservation)
+        storage.append(new_reservations)
+    finally:
+        storage.close()
+    return len(rooms), len(new_reservations)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: python sqlite_storage.py <hotel_room.csv> <reservations.csv> <database.db>")
+        sys.exit(1)
+    try:
+        room_count, reservation_count = migrate_csv_to_sqlite(*sys.argv[1:])
+        print(f"Imported {room_count} rooms and {reservation_count} reservations into '{sys.argv[3]}'.")
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
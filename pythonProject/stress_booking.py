@@ -0,0 +1,114 @@
+# Stress test for concurrent bookings. Several processes book (and sometimes cancel) rooms for overlapping dates in
+# the same reservations file at the same time, the way the console and the GUI would when running side by side.
+# Afterwards every room's stays are checked and the script fails if any two of them overlap. It also fails if the
+# change log isn't numbered without gaps or replaying it doesn't give the reservations that are still booked.
+# Usage: python stress_booking.py [processes] [bookings per process] [csv|sqlite|cols]
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import date, timedelta
+
+from common_functionalities import HotelManager, RoomManager, ReservationManager, Validator
+
+
+# Books random stays over a short window of dates so that the processes keep competing for the same rooms.
+# Returns the number of bookings made and the number that were turned away because no room was free.
+def book_rooms(directory, reservation_file_name, bookings, seed):
+    random.seed(seed)
+    validator = Validator()
+    # A low compaction threshold makes the processes also compact the file under each other's feet
+    reservation_manager = ReservationManager(os.path.join(directory, reservation_file_name), compact_threshold=5)
+    room_manager = RoomManager(os.path.join(directory, "hotel_room.csv"), validator)
+    hotel_manager = HotelManager(room_manager, reservation_manager, validator)
+    room_types = list(room_manager.room_types)
+
+    booked, turned_away = 0, 0
+    references = []
+    for _ in range(bookings):
+        check_in = date.today() + timedelta(days=random.randint(1, 10))
+        check_out = check_in + timedelta(days=random.randint(1, 3))
+        try:
+            reference_number, _ = hotel_manager.make_reservation(
+                f"Guest {seed}", 1, check_in.strftime('%d/%m/%Y'), check_out.strftime('%d/%m/%Y'),
+                {'room_type': random.choice(room_types)})
+            references.append(reference_number)
+            booked += 1
+        except ValueError:
+            turned_away += 1
+        if references and random.random() < 0.2:
+            hotel_manager.cancel_reservation(references.pop(random.randrange(len(references))))
+    return booked, turned_away
+
+
+# Returns the pairs of reservations that share a room for at least one night
+def find_overlaps(reservations):
+    overlaps = []
+    stays_by_room = {}
+    for reservation in reservations:
+        stays_by_room.setdefault(reservation.room_id, []).append(reservation)
+    for stays in stays_by_room.values():
+        stays.sort(key=lambda reservation: reservation.check_in)
+        for previous, current in zip(stays, stays[1:]):
+            if current.check_in < previous.check_out:
+                overlaps.append((previous, current))
+    return overlaps
+
+
+# Replays the change log and returns the problems found: sequence numbers out of order, and reservations the log and
+# the storage disagree on
+def check_change_log(reservation_manager):
+    problems = []
+    live = set()
+    events, _ = reservation_manager.change_feed.read_events()
+    for expected, event in enumerate(events, start=1):
+        if event['sequence'] != expected:
+            problems.append(f"Event {event['sequence']} found where event {expected} was expected.")
+            break
+        if event['type'] == 'created':
+            live.add(event['reservation']['reference_number'])
+        else:
+            live.discard(event['reservation']['reference_number'])
+    stored = set(reservation_manager.reservations)
+    if live != stored:
+        problems.append(f"Replaying the change log gives {len(live - stored)} reservations that aren't stored and "
+                        f"misses {len(stored - live)} that are.")
+    return problems
+
+
+def run_stress_test(processes=8, bookings=50, backend='csv'):
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy("hotel_room.csv", directory)
+        reservation_file_name = {'sqlite': "reservations.db", 'cols': "reservations.cols"}.get(backend,
+                                                                                              "reservations.csv")
+
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(book_rooms, [(directory, reservation_file_name, bookings, seed)
+                                                for seed in range(processes)])
+
+        reservation_manager = ReservationManager(os.path.join(directory, reservation_file_name))
+        reservations = reservation_manager.read_reservation_data()
+        overlaps = find_overlaps(reservations)
+        problems = check_change_log(reservation_manager)
+        print(f"{processes} processes made {sum(booked for booked, _ in results)} bookings "
+              f"({sum(turned_away for _, turned_away in results)} turned away), "
+              f"{len(reservations)} still booked after cancellations, {len(overlaps)} overlapping stays.")
+        for previous, current in overlaps:
+            print(f"Room {current.room_id}: {previous.reference_number} ({previous.check_in_date} - "
+                  f"{previous.check_out_date}) overlaps {current.reference_number} ({current.check_in_date} - "
+                  f"{current.check_out_date})")
+        for problem in problems:
+            print(f"Change log: {problem}")
+        return not overlaps and not problems
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    process_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    booking_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    storage_backend = sys.argv[3] if len(sys.argv) > 3 else 'csv'
+    sys.exit(0 if run_stress_test(process_count, booking_count, storage_backend) else 1)
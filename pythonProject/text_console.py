@@ -1,14 +1,20 @@
 # Implements a text-based console interface for the hotel booking system
+# Setting HOTEL_METRICS=1 before starting it adds a menu option that shows or saves the performance metrics.
+# Usage: python text_console.py [property ID from properties.csv]
+import sys
+
 from common_functionalities import HotelManager, RoomManager, ReservationManager, Validator
+from metrics import metrics
+from properties import PropertyManager
 
 
 # This class serves as the interface for users to interact with the hotel booking system via the console
 class TextConsole:
     # Initialises a 'HotelManager' instance along with 'RoomManager', 'ReservationManager', and 'Validator' instances
-    # from the 'common_functionalities' module
-    def __init__(self):
-        self.hotel_manager = HotelManager(RoomManager("hotel_room.csv", Validator()),
-                                          ReservationManager("reservations.csv"),
+    # from the 'common_functionalities' module, for the given room and reservations files
+    def __init__(self, room_file_name="hotel_room.csv", reservation_file_name="reservations.csv"):
+        self.hotel_manager = HotelManager(RoomManager(room_file_name, Validator()),
+                                          ReservationManager(reservation_file_name),
                                           Validator())
         self.validator = Validator()
 
@@ -20,6 +26,8 @@ class TextConsole:
         print("1. Make a reservation")
         print("2. Cancel a reservation")
         print("3. Exit")
+        if metrics.enabled:
+            print("4. Show performance metrics")
 
     # This method handles the process of booking a room in the hotel
     #  Prompts the user to enter various details required for making a reservation, such as customer name, number of
@@ -98,7 +106,8 @@ class TextConsole:
                 print("Available Room Options:")
                 print("-----------------------")
                 for i, room in enumerate(available_rooms, start=1):
-                    print(f"{i}. Room Type: {room['room_type']}, Price per Night: ${room['price_per_night']:.2f}")
+                    print(f"{i}. Room Type: {room['room_type']}, Price per Night: ${room['price_per_night']:.2f}, "
+                          f"Total for Stay: ${room['total_price']:.2f}, Rooms Left: {room['available_count']}")
 
                 # Lets the user choose a room option
                 choice = self.get_valid_choice("Enter the number of the room you want to book: ", len(available_rooms))
@@ -190,20 +199,18 @@ class TextConsole:
     def cancel_room(self):
         try:
             reference_number = input("Enter the reference number of the reservation to cancel: ")
-            # Using the ReservationManager instance to retrieve the reservation details
-            reservations = self.hotel_manager.reservation_manager.read_reservation_data()
-            reservation = None
-            for res in reservations:
-                if res[0] == reference_number:
-                    reservation = res
-                    break
+            # Using the ReservationManager instance to look up the reservation details by reference number
+            reservation = self.hotel_manager.reservation_manager.get(reference_number)
 
             if reservation:
                 # Extracts reservation details
-                reference_number, customer_name, room_type, check_in_date, check_out_date, total_price = reservation
+                customer_name = reservation.customer_name
+                room_type = reservation.room_type
+                check_in_date = reservation.check_in_date
+                check_out_date = reservation.check_out_date
+                total_price = reservation.total_price
 
                 # Calculates refund amount
-                total_price = float(total_price)
                 refund_amount = self.hotel_manager.calculate_refund(total_price)
 
                 # Generates receipt and refund policy
@@ -233,6 +240,21 @@ class TextConsole:
         except Exception as e:
             print(f"Error: {e}")
 
+    # This method shows the performance metrics recorded so far as Prometheus-style text or JSON, or saves them to a
+    # file (as JSON if its name ends in .json)
+    def show_metrics(self):
+        file_name = input("Enter a file name to save the metrics to (leave blank to show them here): ").strip()
+        try:
+            if file_name:
+                metrics.write(file_name)
+                print(f"Metrics saved to {file_name}.")
+            elif input("Show the metrics as prometheus or json? ").strip().lower() == 'json':
+                print(metrics.to_json())
+            else:
+                print(metrics.to_prometheus())
+        except Exception as e:
+            print(f"Error: {e}")
+
     # This method arranges the overall flow of the console interface by displaying the menu, accepting user input,
     # and executing corresponding actions based on the user's choice.
     def run(self):
@@ -247,10 +269,20 @@ class TextConsole:
                 print("Exiting program...")
                 print("Thank you for using Aakriti's Hotel Booking System. Have a great day!")
                 break
+            elif choice == "4" and metrics.enabled:
+                self.show_metrics()
             else:
                 print("Invalid choice. Please try again.")
 
 
 if __name__ == "__main__":
-    text_console = TextConsole()
+    if len(sys.argv) > 1:
+        try:
+            property_info = PropertyManager().properties[sys.argv[1]]
+        except KeyError:
+            print(f"Error: Unknown property '{sys.argv[1]}'.")
+            sys.exit(1)
+        text_console = TextConsole(property_info['room_file'], property_info['reservation_file'])
+    else:
+        text_console = TextConsole()
     text_console.run()